@@ -0,0 +1,32 @@
+import tracemalloc
+
+import numpy as np
+
+import vq_codec
+from vq_bench import synthetic_image
+
+
+def peak_bytes(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def test_image_blocks_matches_pad_and_split():
+    image = synthetic_image(53, 37)
+    padded, padded_size = vq_codec.pad_image(image, 8, 8)
+    blocks, size = vq_codec.image_blocks(image, 8, 8)
+    assert size == padded_size
+    assert np.array_equal(blocks, vq_codec.split_blocks(padded, 8, 8))
+
+
+def test_image_blocks_halves_peak_memory():
+    # 1001x777 needs padding on both edges, so pad_image makes a full copy
+    image = synthetic_image(1001, 777)
+    old = peak_bytes(lambda: vq_codec.split_blocks(vq_codec.pad_image(image, 8, 8)[0], 8, 8))
+    new = peak_bytes(lambda: vq_codec.image_blocks(image, 8, 8))
+    assert new < 0.6 * old
+    assert new < 1.1 * image.nbytes
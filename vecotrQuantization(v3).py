@@ -6,6 +6,7 @@ import json
 import struct
 import os
 from sklearn.cluster import KMeans
+from vq_assign import nearest_codeword
 
 PANEL_W = 500
 PANEL_H = 400
@@ -125,8 +126,7 @@ def vector_quantization(blocks, n_clusters=256):
 
         groups = np.array_split(sorted_blocks, n_clusters)
         codebook = np.array([g.mean(axis=0) for g in groups], dtype=np.float32)
-        diff = np.sum(np.abs(flat[:, None] - codebook[None, :]), axis=2)
-        labels = np.argmin(diff, axis=1)
+        labels = nearest_codeword(flat, codebook, metric="l1")
         codebook = codebook.reshape(n_clusters, bh, bw, c).astype(np.uint8)
 
         return codebook, labels
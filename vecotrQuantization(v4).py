@@ -1,30 +1,45 @@
 import tkinter
-from tkinter import filedialog, messagebox
-from PIL import Image, ImageTk, ImageOps
+from tkinter import filedialog, messagebox, ttk
+from PIL import Image, ImageTk
 import numpy as np
 import json
-import struct
 import os
-from sklearn.cluster import KMeans
+import queue
+import threading
+import vq_cache
+import vq_codec
+import vq_display
+import vq_format
 
 PANEL_W = 500
 PANEL_H = 400
+POLL_MS = 50
+MAX_CLUSTERS = 500
+MAX_TREE_CLUSTERS = 8192
 
-originalImage = None
+originalPath = None
 originalNp = None
 originalSize = None
-imgNp = None
-paddedImg = None
 paddedSize = None
-blocks = None
 is_processing = False
+job_queue = None
+job_cancel = None
+codebook_cache = vq_cache.CodebookCache()
+panel_cache = vq_display.PanelCache(ImageTk.PhotoImage)
 current_codebook = None
 current_labels = None
+current_layout = None
+current_block_size = None
 current_reconstructed = None
 mode = "compress"
 
+def show_panel(label, key, image):
+    photo = panel_cache.render(key, image, (PANEL_W, PANEL_H))
+    label.configure(image=photo, text="")
+    label.image = photo
+
 def upload():
-    global originalImage, originalNp, originalSize, mode
+    global originalPath, originalNp, originalSize, mode
     try:
         file_path = filedialog.askopenfilename(
             title="Select an image: ",
@@ -39,118 +54,32 @@ def upload():
             return
         
         mode = "compress"
-        originalImage = Image.open(file_path).convert("RGB")
-        originalNp = np.array(originalImage)
-        originalSize = originalImage.size
-
-        display_img = ImageOps.contain(originalImage, (PANEL_W, PANEL_H), Image.Resampling.LANCZOS)
-        bg = Image.new("RGB", (PANEL_W, PANEL_H), (255, 255, 255))
-        x = (PANEL_W - display_img.width) // 2
-        y = (PANEL_H - display_img.height) // 2
-        bg.paste(display_img, (x, y))
-        photo = ImageTk.PhotoImage(bg)
-        original_label.configure(image=photo, text="")
-        original_label.image = photo
+        # only the header is read here; pixels are decoded when encoding starts
+        with Image.open(file_path) as image:
+            originalSize = image.size
+        originalPath = file_path
+        originalNp = None
+
+        show_panel(original_label, vq_display.file_key(file_path),
+                   lambda: vq_display.open_image(file_path, (PANEL_W, PANEL_H)))
         
         proceLabel.configure(image="", text="Processed Image\n(Compressed/Decompressed)")
         
     except Exception as e:
         messagebox.showerror("Error", f"Failed to load image:\n{str(e)}")
 
-def padding():
-    global imgNp, paddedImg, paddedSize, originalNp, originalSize
-
-    if originalNp is None:
-        return False
-
+def save_compressed_data(codebook, labels, block_w, block_h, padded_size, original_size, filepath,
+                         label_coding=vq_format.DEFAULT_LABEL_CODING, layout=None):
     try:
-        block_w = int(widthEn.get() or 8)
-        block_h = int(heightEn.get() or 8)
-        
-        if block_w <= 0 or block_h <= 0:
-            messagebox.showerror("Invalid Input", "Block width and height must be positive!")
-            return False
-        
-        h, w, c = originalNp.shape
-        pad_h = (block_h - (h % block_h)) % block_h
-        pad_w = (block_w - (w % block_w)) % block_w
-        
-        if pad_h > 0 or pad_w > 0:
-            padded = np.pad(originalNp, ((0, pad_h), (0, pad_w), (0, 0)), mode='edge')
-            imgNp = padded
-            paddedImg = Image.fromarray(padded)
-            paddedSize = (w + pad_w, h + pad_h)
-        else:
-            imgNp = originalNp.copy()
-            paddedImg = originalImage.copy()
-            paddedSize = originalSize
-        
-        return True
-        
-    except ValueError:
-        messagebox.showerror("Invalid Input", "Please enter valid numbers for block dimensions!")
-        return False
-    except Exception as e:
-        messagebox.showerror("Error", f"Padding failed:\n{str(e)}")
-        return False
-
-def split2blocks():
-    global blocks, imgNp
-
-    if imgNp is None:
-        return None
-
-    try:
-        block_w = int(widthEn.get() or 8)
-        block_h = int(heightEn.get() or 8)
-        
-        h, w, c = imgNp.shape
-        blocks_arr = imgNp.reshape(h // block_h, block_h, w // block_w, block_w, 3)
-        blocks_arr = blocks_arr.swapaxes(1, 2).reshape(-1, block_h, block_w, 3)
-        blocks = blocks_arr
-        return blocks
-        
-    except Exception as e:
-        messagebox.showerror("Error", f"Failed to split blocks:\n{str(e)}")
-        return None
-def vector_quantization(blocks, n_clusters):
-    try:
-        n_blocks, bh, bw, c = blocks.shape
-        flat = blocks.reshape(n_blocks, -1)
-        n_clusters = min(n_clusters, n_blocks)
-
-        means = flat.mean(axis=1)
-        sorted_idx = np.argsort(means)
-        sorted_blocks = flat[sorted_idx]
-
-        groups = np.array_split(sorted_blocks, n_clusters)
-        codebook = np.array([g.mean(axis=0) for g in groups], dtype=np.float32)
-        diff = np.sum(np.abs(flat[:, None] - codebook[None, :]), axis=2)
-        labels = np.argmin(diff, axis=1)
-        codebook = codebook.reshape(n_clusters, bh, bw, c).astype(np.uint8)
-
-        return codebook, labels
-
-    except Exception as e:
-        messagebox.showerror("Error", str(e))
-        return None, None
-
-def save_compressed_data(codebook, labels, block_w, block_h, padded_size, original_size, filepath):
-    try:
-        with open(filepath, 'wb') as f:
-            f.write(struct.pack('I', block_w))
-            f.write(struct.pack('I', block_h))
-            f.write(struct.pack('I', padded_size[0]))
-            f.write(struct.pack('I', padded_size[1]))
-            f.write(struct.pack('I', original_size[0]))
-            f.write(struct.pack('I', original_size[1]))
-            f.write(struct.pack('I', len(codebook)))
-            f.write(struct.pack('I', len(labels)))
-            
-            for codeword in codebook:
-                f.write(codeword.astype(np.uint8).tobytes())
-            
-            f.write(np.array(labels, dtype=np.uint16).tobytes())
+        vq_format.save_compressed({
+            'codebook': codebook,
+            'labels': labels,
+            'block_w': block_w,
+            'block_h': block_h,
+            'padded_size': padded_size,
+            'original_size': original_size,
+            'layout': layout
+        }, filepath, label_coding)
         
         return True
         
@@ -174,17 +103,9 @@ def save_codebook_json(codebook, filepath):
         messagebox.showerror("Error", f"Failed to save JSON file:\n{str(e)}")
         return False
 
-def reconstruct_image(codebook, labels, block_h, block_w, padded_size, original_size):
+def reconstruct_image(codebook, labels, block_h, block_w, padded_size, original_size, layout=None):
     try:
-        reconstructed_blocks = codebook[labels]
-        
-        w_blocks = padded_size[0] // block_w
-        h_blocks = padded_size[1] // block_h
-        reconstructed = reconstructed_blocks.reshape(h_blocks, w_blocks, block_h, block_w, 3)
-        reconstructed = reconstructed.swapaxes(1, 2).reshape(padded_size[1], padded_size[0], 3)
-        reconstructed = reconstructed[:original_size[1], :original_size[0], :]
-        
-        return reconstructed.astype(np.uint8)
+        return vq_codec.reconstruct(codebook, labels, block_w, block_h, padded_size, original_size, layout=layout)
         
     except Exception as e:
         messagebox.showerror("Error", f"Failed to reconstruct image:\n{str(e)}")
@@ -194,14 +115,70 @@ def disable_buttons():
     uploadBtn.config(state='disabled')
     uploadBinBtn.config(state='disabled')
     processBtn.config(state='disabled')
+    saveBtn.config(state='disabled')
 
 def enable_buttons():
     uploadBtn.config(state='normal')
     uploadBinBtn.config(state='normal')
     processBtn.config(state='normal')
+    saveBtn.config(state='normal')
+
+class JobCancelled(Exception):
+    pass
+
+def compression_job(image, block_w, block_h, n_clusters, quantizer, cancel_event, results, show_preview=False):
+    def report(fraction, text):
+        if cancel_event.is_set():
+            raise JobCancelled()
+        results.put(("progress", fraction, text))
+
+    try:
+        if isinstance(image, np.ndarray):
+            h, w = image.shape[:2]
+            small = image
+        else:
+            with Image.open(image) as header:
+                w, h = header.size
+            small = np.asarray(vq_display.open_image(image, (PANEL_W, PANEL_H))) if show_preview else None
+        if show_preview and (w > PANEL_W or h > PANEL_H):
+            report(0.0, "Previewing...")
+            results.put(("preview", vq_codec.preview(small, block_w, block_h, n_clusters, (PANEL_W, PANEL_H),
+                                                     w / small.shape[1])))
+        if not isinstance(image, np.ndarray):
+            report(0.0, "Decoding...")
+            # draft decoding only shrinks JPEGs; other formats were already decoded in full
+            image = small if small is not None and small.shape[1] == w else np.asarray(vq_display.open_image(image))
+        del small
+        report(0.05, "Splitting into blocks...")
+        blocks_arr, padded_size = vq_codec.image_blocks(image, block_w, block_h)
+        report(0.1, "Training codebook...")
+        codebook, labels = codebook_cache.quantize(
+            blocks_arr, n_clusters, quantizer,
+            progress=lambda done, total: report(0.7 + 0.2 * done / total, "Assigning blocks..."),
+            train_progress=lambda done, total: report(0.1 + 0.6 * done / total, "Training codebook...")
+        )
+        report(0.9, "Reconstructing...")
+        layout = vq_codec.stage_layout(quantizer)
+        reconstructed = vq_codec.reconstruct(codebook, labels, block_w, block_h, padded_size, (w, h),
+                                             layout=layout)
+        report(1.0, "Done")
+        results.put(("done", {
+            'codebook': codebook,
+            'labels': labels,
+            'block_w': block_w,
+            'block_h': block_h,
+            'padded_size': padded_size,
+            'layout': layout,
+            'reconstructed': reconstructed,
+            'image': image
+        }))
+    except JobCancelled:
+        results.put(("cancelled",))
+    except Exception as e:
+        results.put(("error", str(e)))
 
 def process_compression():
-    global is_processing, current_codebook, current_labels, current_reconstructed
+    global is_processing, job_queue, job_cancel
     
     if is_processing:
         return
@@ -209,7 +186,7 @@ def process_compression():
     if mode == "decompress":
         process_decompression()
         return
-    if originalNp is None:
+    if originalPath is None:
         messagebox.showwarning("No Image", "Please upload an image first!")
         return
     block_w = widthEn.get().strip()
@@ -222,7 +199,7 @@ def process_compression():
             if n_clusters_val <= 0:
                 messagebox.showerror("Invalid Input", "Number of blocks must be positive!")
                 return
-            elif n_clusters_val > 500:
+            elif n_clusters_val > (MAX_TREE_CLUSTERS if modeVar.get() == "tree" else MAX_CLUSTERS):
                 messagebox.showerror("Invalid Input", "Number of blocks is very big!")
                 return
 
@@ -238,69 +215,114 @@ def process_compression():
         heightEn.delete(0, tkinter.END)
         heightEn.insert(0, "8")
     
+    try:
+        block_w_val = int(widthEn.get())
+        block_h_val = int(heightEn.get())
+    except ValueError:
+        messagebox.showerror("Invalid Input", "Please enter valid numbers for block dimensions!")
+        return
+    
+    if block_w_val <= 0 or block_h_val <= 0:
+        messagebox.showerror("Invalid Input", "Block width and height must be positive!")
+        return
+    
     is_processing = True
     disable_buttons()
+    cancelBtn.config(state='normal')
+    progressBar['value'] = 0
+    
+    job_queue = queue.Queue()
+    job_cancel = threading.Event()
+    worker = threading.Thread(
+        target=compression_job,
+        args=(originalPath if originalNp is None else originalNp,
+              block_w_val, block_h_val, n_clusters_val, modeVar.get(),
+              job_cancel, job_queue, previewVar.get()),
+        daemon=True
+    )
+    worker.start()
+    root.after(POLL_MS, poll_compression)
+
+def cancel_compression():
+    if is_processing and job_cancel is not None:
+        job_cancel.set()
+        statusLabel.configure(text="Cancelling...")
+
+def finish_job(status=""):
+    global is_processing
     
+    is_processing = False
+    enable_buttons()
+    cancelBtn.config(state='disabled')
+    progressBar['value'] = 0
+    statusLabel.configure(text=status)
+
+def poll_compression():
     try:
-        if not padding():
-            enable_buttons()
-            is_processing = False
-            return
-        
-        blocks_arr = split2blocks()
-        if blocks_arr is None:
-            enable_buttons()
-            is_processing = False
-            return
-        
-        codebook, labels = vector_quantization(blocks_arr, n_clusters=n_clusters_val)
-        if codebook is None or labels is None:
-            enable_buttons()
-            is_processing = False
-            return
+        while True:
+            message = job_queue.get_nowait()
+            kind = message[0]
+            
+            if kind == "progress":
+                progressBar['value'] = message[1] * 100
+                statusLabel.configure(text=message[2])
+            elif kind == "preview":
+                show_panel(proceLabel, None, message[1])
+            elif kind == "done":
+                finish_job()
+                show_compression_result(message[1])
+                return
+            elif kind == "cancelled":
+                finish_job("Cancelled")
+                proceLabel.configure(image="", text="Processed Image\n(Compressed/Decompressed)")
+                return
+            else:
+                finish_job()
+                proceLabel.configure(image="", text="Processed Image\n(Compressed/Decompressed)")
+                messagebox.showerror("Error", f"Compression failed:\n{message[1]}")
+                return
+    except queue.Empty:
+        pass
+    
+    root.after(POLL_MS, poll_compression)
 
+def show_compression_result(result):
+    global current_codebook, current_labels, current_layout, current_reconstructed, paddedSize, originalNp
+    global current_block_size
+    
+    if originalPath is None:
+        return
+    
+    try:
+        originalNp = result['image']
+        codebook = result['codebook']
+        labels = result['labels']
         current_codebook = codebook
         current_labels = labels
-
-        block_w_val = int(widthEn.get())
-        block_h_val = int(heightEn.get())
+        current_layout = result['layout']
+        current_reconstructed = result['reconstructed']
+        paddedSize = result['padded_size']
+        block_w_val = result['block_w']
+        block_h_val = result['block_h']
+        current_block_size = (block_w_val, block_h_val)
         
-        reconstructed = reconstruct_image(codebook, labels, block_h_val, block_w_val, 
-                                          paddedSize, originalSize)
+        show_panel(proceLabel, None, current_reconstructed)
         
-        if reconstructed is not None:
-            current_reconstructed = reconstructed
-            reconstructed_img = Image.fromarray(reconstructed)
-            display_img = ImageOps.contain(reconstructed_img, (PANEL_W, PANEL_H), 
-                                          Image.Resampling.LANCZOS)
-            bg = Image.new("RGB", (PANEL_W, PANEL_H), (255, 255, 255))
-            x = (PANEL_W - display_img.width) // 2
-            y = (PANEL_H - display_img.height) // 2
-            bg.paste(display_img, (x, y))
-            photo = ImageTk.PhotoImage(bg)
-            proceLabel.configure(image=photo, text="")
-            proceLabel.image = photo
-            
-            original_size_bytes = originalSize[0] * originalSize[1] * 3
-            codebook_size = len(codebook) * block_w_val * block_h_val * 3
-            labels_size = len(labels) * 2
-            compressed_size_bytes = codebook_size + labels_size + 32
-            ratio = original_size_bytes / compressed_size_bytes
-            
-            messagebox.showinfo(
-                "Compression Complete",
-                f"Image compressed successfully!\n\n"
-                f"Block size: {block_w_val}×{block_h_val}\n"
-                f"Compression ratio: {ratio:.2f}:1\n\n"
-                f"Press 'Save' to save the compressed file."
-            )
+        original_size_bytes = originalSize[0] * originalSize[1] * 3
+        compressed_size_bytes = vq_format.encoded_size({'codebook': codebook, 'labels': labels, 'layout': current_layout},
+                                                       labelCodingVar.get())
+        ratio = original_size_bytes / compressed_size_bytes
+        
+        messagebox.showinfo(
+            "Compression Complete",
+            f"Image compressed successfully!\n\n"
+            f"Block size: {block_w_val}×{block_h_val}\n"
+            f"Compression ratio: {ratio:.2f}:1\n\n"
+            f"Press 'Save' to save the compressed file."
+        )
         
     except Exception as e:
         messagebox.showerror("Error", f"Compression failed:\n{str(e)}")
-    
-    finally:
-        enable_buttons()
-        is_processing = False
 
 def process_decompression():
     global current_reconstructed, decompress_data
@@ -316,21 +338,13 @@ def process_decompression():
             decompress_data['block_h'],
             decompress_data['block_w'],
             decompress_data['padded_size'],
-            decompress_data['original_size']
+            decompress_data['original_size'],
+            decompress_data['layout']
         )
         
         if reconstructed is not None:
             current_reconstructed = reconstructed
-            reconstructed_img = Image.fromarray(reconstructed)
-            display_img = ImageOps.contain(reconstructed_img, (PANEL_W, PANEL_H), 
-                                          Image.Resampling.LANCZOS)
-            bg = Image.new("RGB", (PANEL_W, PANEL_H), (255, 255, 255))
-            x = (PANEL_W - display_img.width) // 2
-            y = (PANEL_H - display_img.height) // 2
-            bg.paste(display_img, (x, y))
-            photo = ImageTk.PhotoImage(bg)
-            proceLabel.configure(image=photo, text="")
-            proceLabel.image = photo
+            show_panel(proceLabel, None, reconstructed)
             
             messagebox.showinfo("Success", "Image decompressed successfully!\n\nPress 'Save' to save the image.")
     
@@ -340,6 +354,9 @@ def process_decompression():
 def save_files():
     global current_codebook, current_labels
     
+    if is_processing:
+        return
+    
     if mode == "decompress":
         if current_reconstructed is None:
             messagebox.showwarning("No Image", "Please process the decompression first!")
@@ -382,11 +399,10 @@ def save_files():
         return
     
     try:
-        block_w_val = int(widthEn.get() or 8)
-        block_h_val = int(heightEn.get() or 8)
+        block_w_val, block_h_val = current_block_size
         
         if not save_compressed_data(current_codebook, current_labels, block_w_val, block_h_val, 
-                                     paddedSize, originalSize, save_path):
+                                     paddedSize, originalSize, save_path, labelCodingVar.get(), current_layout):
             return
         
         json_path = save_path.rsplit('.', 1)[0] + '_codebook.json'
@@ -410,25 +426,25 @@ def save_files():
     clear_all()
 
 def clear_all():
-    global originalImage, originalNp, originalSize, imgNp, paddedImg, paddedSize, blocks
+    global originalPath, originalNp, originalSize, paddedSize
     
-    originalImage = None
+    originalPath = None
     originalNp = None
     originalSize = None
-    imgNp = None
-    paddedImg = None
     paddedSize = None
-    blocks = None
     
     original_label.configure(image="", text="Original Image")
     proceLabel.configure(image="", text="Processed Image\n(Compressed/Decompressed)")
     widthEn.delete(0, tkinter.END)
     heightEn.delete(0, tkinter.END)
     numBLOCKen.delete(0, tkinter.END)
-    enable_buttons()
+    if is_processing:
+        cancel_compression()
+    else:
+        enable_buttons()
 
 def uploadBINfile():
-    global mode, current_codebook, current_labels, originalImage, originalNp, originalSize
+    global mode, current_codebook, current_labels, originalPath, originalNp, originalSize
     
     filepath = filedialog.askopenfilename(
         title="Select compressed .bin file",
@@ -445,32 +461,19 @@ def uploadBINfile():
     try:
         mode = "decompress"
         
-        with open(filepath, 'rb') as f:
-            block_w = struct.unpack('I', f.read(4))[0]
-            block_h = struct.unpack('I', f.read(4))[0]
-            padded_w = struct.unpack('I', f.read(4))[0]
-            padded_h = struct.unpack('I', f.read(4))[0]
-            orig_w = struct.unpack('I', f.read(4))[0]
-            orig_h = struct.unpack('I', f.read(4))[0]
-            n_codewords = struct.unpack('I', f.read(4))[0]
-            n_blocks = struct.unpack('I', f.read(4))[0]
-            codebook_size = n_codewords * block_h * block_w * 3
-            codebook_data = f.read(codebook_size)
-            codebook = np.frombuffer(codebook_data, dtype=np.uint8)
-            codebook = codebook.reshape(n_codewords, block_h, block_w, 3)
-            
-            labels_data = f.read(n_blocks * 2)
-            labels = np.frombuffer(labels_data, dtype=np.uint16)
-        
         global decompress_data
-        decompress_data = {
-            'codebook': codebook,
-            'labels': labels,
-            'block_w': block_w,
-            'block_h': block_h,
-            'padded_size': (padded_w, padded_h),
-            'original_size': (orig_w, orig_h)
-        }
+        decompress_data = vq_format.load_compressed(filepath)
+        if decompress_data['codebook'] is None:
+            codebook_path = filedialog.askopenfilename(
+                title=f"Select shared codebook {decompress_data['codebook_id']}",
+                filetypes=[("Codebook Files", "*.vqcb"), ("All Files", "*.*")]
+            )
+            if not codebook_path:
+                decompress_data = None
+                return
+            vq_format.attach_codebook(decompress_data, vq_format.load_codebook(codebook_path))
+        block_w = decompress_data['block_w']
+        block_h = decompress_data['block_h']
         
         widthEn.delete(0, tkinter.END)
         widthEn.insert(0, str(block_w))
@@ -481,15 +484,8 @@ def uploadBINfile():
         agreement_path = os.path.join(script_dir, "aggrement.png")
         
         if os.path.exists(agreement_path):
-            agreement_img = Image.open(agreement_path).convert("RGB")
-            display_img = ImageOps.contain(agreement_img, (PANEL_W, PANEL_H), Image.Resampling.LANCZOS)
-            bg = Image.new("RGB", (PANEL_W, PANEL_H), (255, 255, 255))
-            x = (PANEL_W - display_img.width) // 2
-            y = (PANEL_H - display_img.height) // 2
-            bg.paste(display_img, (x, y))
-            photo = ImageTk.PhotoImage(bg)
-            original_label.configure(image=photo, text="")
-            original_label.image = photo
+            show_panel(original_label, vq_display.file_key(agreement_path),
+                       lambda: vq_display.open_image(agreement_path, (PANEL_W, PANEL_H)))
         else:
             original_label.configure(image="", text="Compressed File Loaded\n(aggrement.png not found)")
         proceLabel.configure(image="", text="Processed Image\n(Compressed/Decompressed)")
@@ -500,8 +496,8 @@ def uploadBINfile():
         messagebox.showerror("Error", f"Failed to load .bin file:\n{str(e)}")
 
 def create_gui():
-    global original_label, proceLabel, widthEn, heightEn,numBLOCKen
-    global uploadBtn, uploadBinBtn, processBtn, clearBtn
+    global original_label, proceLabel, widthEn, heightEn,numBLOCKen, modeVar, labelCodingVar, previewVar
+    global uploadBtn, uploadBinBtn, processBtn, clearBtn, saveBtn, cancelBtn, progressBar, statusLabel
     
     top_frame = tkinter.Frame(root, bg="#f0f0f0")
     top_frame.pack(pady=10, fill="x")
@@ -593,6 +589,32 @@ def create_gui():
     numBLOCKen = tkinter.Entry(con, width=8, font=("Arial", 12), bd=1)
     numBLOCKen.grid(row=1, column=3, padx=5, pady=10)
 
+    tkinter.Label(
+        con, text="Quantizer: ", 
+        bg="#f0f0f0", font=(12)
+    ).grid(row=0, column=2, padx=5, pady=10)
+
+    modeVar = tkinter.StringVar(value=vq_codec.DEFAULT_MODE)
+    modeMenu = tkinter.OptionMenu(con, modeVar, *vq_codec.QUANTIZER_MODES)
+    modeMenu.config(bg="white", bd=1)
+    modeMenu.grid(row=0, column=3, padx=5, pady=10)
+
+    tkinter.Label(
+        con, text="Label coding: ", 
+        bg="#f0f0f0", font=(12)
+    ).grid(row=2, column=2, padx=5, pady=10)
+
+    labelCodingVar = tkinter.StringVar(value=vq_format.DEFAULT_LABEL_CODING)
+    labelCodingMenu = tkinter.OptionMenu(con, labelCodingVar, *vq_format.LABEL_CODINGS)
+    labelCodingMenu.config(bg="white", bd=1)
+    labelCodingMenu.grid(row=2, column=3, padx=5, pady=10)
+
+    previewVar = tkinter.BooleanVar(value=True)
+    tkinter.Checkbutton(
+        con, text="Quick preview", variable=previewVar,
+        bg="#f0f0f0", font=(12)
+    ).grid(row=2, column=0, columnspan=2, padx=5, pady=10)
+
     
     runningButton = tkinter.Frame(root, bg="#f0f0f0")
     runningButton.pack(padx=20, side=tkinter.RIGHT)
@@ -605,17 +627,32 @@ def create_gui():
     )
     processBtn.grid(row=0, column=0, padx=20, pady=20)
 
-root = tkinter.Tk()
-root.title("Vecto")
+    cancelBtn = tkinter.Button(
+        runningButton, text="Cancel", 
+        command=cancel_compression, state='disabled',
+        width=10, height=3, bg="white", fg="black", 
+        font=(11), bd=1
+    )
+    cancelBtn.grid(row=0, column=1, padx=10, pady=20)
 
-script_dir = os.path.dirname(os.path.abspath(__file__))
-icon_path = os.path.join(script_dir, "icon.png")
+    progressBar = ttk.Progressbar(runningButton, length=260, mode='determinate', maximum=100)
+    progressBar.grid(row=1, column=0, columnspan=2, padx=20)
 
-try:
-    icon = ImageTk.PhotoImage(Image.open(icon_path))
-    root.iconphoto(False, icon)
-except:
-    pass
+    statusLabel = tkinter.Label(runningButton, text="", bg="#f0f0f0", font=(10))
+    statusLabel.grid(row=2, column=0, columnspan=2, padx=20, pady=5)
+
+if __name__ == "__main__":
+    root = tkinter.Tk()
+    root.title("Vecto")
+
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    icon_path = os.path.join(script_dir, "icon.png")
+
+    try:
+        icon = ImageTk.PhotoImage(Image.open(icon_path))
+        root.iconphoto(False, icon)
+    except:
+        pass
 
-create_gui()
-root.mainloop()
\ No newline at end of file
+    create_gui()
+    root.mainloop()
\ No newline at end of file
@@ -0,0 +1,386 @@
+import numpy as np
+
+from vq_trace import traced
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+METRICS = ("l1", "l2")
+SEARCHES = ("full", "pruned")
+# int16 only changes l1, whose per-tile difference tensor dominates; l2 is a float32 matrix product
+COMPUTE_DTYPES = ("float32", "int16")
+# Codebooks smaller than this are always searched exhaustively
+INDEX_MIN_CODEWORDS = 1024
+DEFAULT_PROBE = 8
+# Dimension chunks summed between early-exit checks in partial_distance
+PDE_CHUNKS = 4
+# Sub-vector sums per block used for the tighter lower bound in pruned_codeword
+BOUND_GROUPS = 8
+
+
+def tile_rows(n_clusters, dim, metric="l1", max_bytes=DEFAULT_MAX_BYTES, itemsize=4):
+    """Number of blocks handled per tile so the working set stays under max_bytes"""
+    if metric == "l2":
+        per_row = (n_clusters + dim) * itemsize
+    else:
+        per_row = (n_clusters * dim + dim) * itemsize
+    return max(1, int(max_bytes // max(per_row, 1)))
+
+
+def compute_dtype(flat, codebook, metric="l1", dtype=None):
+    """Resolve the dtype nearest_codeword computes in; None picks int16 whenever it is exact
+
+    That is l1 with uint8 blocks and a uint8 codebook, e.g. the stored
+    codewords. Forcing "int16" rounds a float codebook to integers; l2
+    always computes in float32.
+    """
+    if dtype is not None and dtype not in COMPUTE_DTYPES:
+        raise ValueError(f"Unknown compute dtype: {dtype!r}")
+    if metric != "l1":
+        return "float32"
+    if dtype is None:
+        exact = flat.dtype == np.uint8 and np.asarray(codebook).dtype == np.uint8
+        return "int16" if exact else "float32"
+    return dtype
+
+
+def nearest_codeword(flat, codebook, metric="l1", max_bytes=DEFAULT_MAX_BYTES, progress=None, dtype=None):
+    """Index of the closest codeword for every row of flat, computed tile by tile
+
+    progress, if given, is called as progress(done, total) after every tile.
+    dtype is resolved by compute_dtype; in int16, l1 differences of uint8
+    blocks take half the memory traffic of float32 and are summed in int32.
+    """
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric: {metric!r}")
+    dtype = compute_dtype(flat, codebook, metric, dtype)
+
+    flat = flat.reshape(len(flat), -1)
+    n_blocks, dim = flat.shape
+    cb = np.asarray(codebook, dtype=np.float32).reshape(len(codebook), -1)
+    n_clusters = len(cb)
+    if cb.shape[1] != dim:
+        raise ValueError(f"Codeword size {cb.shape[1]} does not match block size {dim}")
+
+    labels = np.empty(n_blocks, dtype=np.intp)
+    if metric == "l1" and dtype == "int16":
+        if flat.dtype != np.uint8:
+            raise ValueError("int16 distances need uint8 blocks")
+        cb16 = np.clip(np.rint(cb), 0, 255).astype(np.int16)
+        step = tile_rows(n_clusters, dim, metric, max_bytes, itemsize=2)
+        for start in range(0, n_blocks, step):
+            diff = flat[start:start + step, None, :].astype(np.int16) - cb16
+            np.abs(diff, out=diff)
+            labels[start:start + step] = np.argmin(diff.sum(axis=2, dtype=np.int32), axis=1)
+            if progress is not None:
+                progress(min(start + step, n_blocks), n_blocks)
+        return labels
+
+    step = tile_rows(n_clusters, dim, metric, max_bytes)
+    cb_sq = np.einsum("ij,ij->i", cb, cb) if metric == "l2" else None
+    for start in range(0, n_blocks, step):
+        x = flat[start:start + step].astype(np.float32, copy=False)
+        labels[start:start + step] = np.argmin(block_distances(x, cb, metric, cb_sq), axis=1)
+        if progress is not None:
+            progress(min(start + step, n_blocks), n_blocks)
+
+    return labels
+
+
+def block_distances(x, cb, metric="l1", cb_sq=None):
+    """(len(x), len(cb)) matrix of distances, comparable along each row
+
+    For "l2" the ||x||^2 term is left out since it is the same for every
+    codeword of a row; pass cb_sq (the squared codeword norms) to reuse it.
+    """
+    if metric == "l2":
+        if cb_sq is None:
+            cb_sq = np.einsum("ij,ij->i", cb, cb)
+        dist = x @ cb.T
+        dist *= -2.0
+        dist += cb_sq
+        return dist
+    diff = x[:, None, :] - cb[None, :, :]
+    np.abs(diff, out=diff)
+    return diff.sum(axis=2)
+
+
+def codeword_distances(cb, metric="l1", max_bytes=DEFAULT_MAX_BYTES):
+    """(len(cb), len(cb)) matrix of distances between codewords (true l2, not squared), or None
+
+    Rows are computed a tile at a time as in nearest_codeword. None means the
+    matrix plus a single tile would not fit in max_bytes.
+    """
+    n_clusters, dim = cb.shape
+    remaining = max_bytes - n_clusters * n_clusters * 4
+    per_row = (n_clusters + dim if metric == "l2" else n_clusters * dim + dim) * 4
+    if remaining < per_row:
+        return None
+    between = np.empty((n_clusters, n_clusters), dtype=np.float32)
+    cb_sq = np.einsum("ij,ij->i", cb, cb) if metric == "l2" else None
+    step = tile_rows(n_clusters, dim, metric, remaining)
+    for start in range(0, n_clusters, step):
+        dist = block_distances(cb[start:start + step], cb, metric, cb_sq)
+        if metric == "l2":
+            dist += cb_sq[start:start + step, None]
+            np.sqrt(np.maximum(dist, 0, out=dist), out=dist)
+        between[start:start + step] = dist
+    return between
+
+
+@traced("assign")
+def tree_codeword(flat, tree, max_bytes=DEFAULT_MAX_BYTES, progress=None):
+    """Leaf index for every row of flat, found by descending a tree from vq_train.build_tree
+
+    Each level costs one dot product per block, so assignment is
+    O(depth * dim) per block instead of O(n_codewords * dim).
+    """
+    flat = flat.reshape(len(flat), -1)
+    n_blocks, dim = flat.shape
+    w, t = tree['w'], tree['t']
+    left, right, leaf = tree['left'], tree['right'], tree['leaf']
+    if w.shape[1] != dim:
+        raise ValueError(f"Tree dimension {w.shape[1]} does not match block size {dim}")
+
+    labels = np.empty(n_blocks, dtype=np.intp)
+    step = max(1, int(max_bytes // (3 * dim * 4)))
+    for start in range(0, n_blocks, step):
+        x = flat[start:start + step].astype(np.float32)
+        node = np.zeros(len(x), dtype=np.intp)
+        active = np.arange(len(x))
+        while active.size:
+            current = node[active]
+            inner = left[current] >= 0
+            active = active[inner]
+            current = current[inner]
+            if not active.size:
+                break
+            go_left = np.einsum("ij,ij->i", x[active], w[current]) > t[current]
+            node[active] = np.where(go_left, left[current], right[current])
+        labels[start:start + step] = leaf[node]
+        if progress is not None:
+            progress(min(start + step, n_blocks), n_blocks)
+
+    return labels
+
+
+def build_index(codebook, n_lists=None, iters=10, seed=0):
+    """Inverted-file index over a codebook: codewords bucketed under coarse centroids
+
+    n_lists defaults to about sqrt(n_codewords). The coarse centroids are
+    found with a few Lloyd iterations over the codewords themselves.
+    """
+    cb = np.asarray(codebook, dtype=np.float32).reshape(len(codebook), -1)
+    n_lists = min(n_lists or max(1, int(round(np.sqrt(len(cb))))), len(cb))
+    rng = np.random.default_rng(seed)
+    coarse = cb[rng.choice(len(cb), size=n_lists, replace=False)].copy()
+    for _ in range(iters):
+        assign = nearest_codeword(cb, coarse, metric="l2")
+        counts = np.bincount(assign, minlength=n_lists)
+        sums = np.zeros_like(coarse)
+        np.add.at(sums, assign, cb)
+        filled = counts > 0
+        coarse[filled] = sums[filled] / counts[filled, None]
+    assign = nearest_codeword(cb, coarse, metric="l2")
+    return {
+        'codebook': cb,
+        'coarse': coarse,
+        'lists': [np.flatnonzero(assign == i) for i in range(n_lists)]
+    }
+
+
+def indexed_codeword(flat, index, n_probe=DEFAULT_PROBE, metric="l1", max_bytes=DEFAULT_MAX_BYTES,
+                     progress=None):
+    """Approximate nearest codeword for every row of flat, searching only n_probe buckets of index
+
+    Each block is compared with the codewords of the n_probe buckets whose
+    coarse centroids are closest to it, so larger n_probe trades speed for
+    accuracy; with n_probe >= the number of buckets the search is exact.
+    """
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric: {metric!r}")
+    if n_probe <= 0:
+        raise ValueError("n_probe must be positive")
+
+    cb, coarse, lists = index['codebook'], index['coarse'], index['lists']
+    if n_probe >= len(lists):
+        return nearest_codeword(flat, cb, metric, max_bytes, progress)
+
+    flat = flat.reshape(len(flat), -1)
+    n_blocks, dim = flat.shape
+    if cb.shape[1] != dim:
+        raise ValueError(f"Codeword size {cb.shape[1]} does not match block size {dim}")
+
+    labels = np.empty(n_blocks, dtype=np.intp)
+    longest = max(len(members) for members in lists)
+    step = tile_rows(max(longest, len(lists)), dim, metric, max_bytes)
+    for start in range(0, n_blocks, step):
+        x = flat[start:start + step].astype(np.float32)
+        probes = np.argpartition(block_distances(x, coarse, "l2"), n_probe - 1, axis=1)[:, :n_probe]
+        best = np.full(len(x), np.inf, dtype=np.float32)
+        best_label = labels[start:start + step]
+        for i, members in enumerate(lists):
+            rows = np.flatnonzero((probes == i).any(axis=1))
+            if not len(rows) or not len(members):
+                continue
+            dist = block_distances(x[rows], cb[members], metric)
+            nearest = np.argmin(dist, axis=1)
+            nearest_dist = dist[np.arange(len(rows)), nearest]
+            better = nearest_dist < best[rows]
+            best[rows[better]] = nearest_dist[better]
+            best_label[rows[better]] = members[nearest[better]]
+        if progress is not None:
+            progress(min(start + step, n_blocks), n_blocks)
+
+    return labels
+
+
+def compare_assignments(flat, codebook, labels, metric="l1", max_bytes=DEFAULT_MAX_BYTES):
+    """How approximate labels differ from exact search: changed blocks and added distortion
+
+    Returns a dict with the number of blocks, how many got a different
+    codeword than exhaustive search would give them, that fraction, and the
+    relative increase of the total distance to the assigned codewords.
+    """
+    flat = flat.reshape(len(flat), -1)
+    cb = np.asarray(codebook, dtype=np.float32).reshape(len(codebook), -1)
+    labels = np.asarray(labels)
+    exact = nearest_codeword(flat, cb, metric, max_bytes)
+    differ = int(np.count_nonzero(exact != labels))
+
+    def total_error(chosen):
+        total = 0.0
+        step = max(1, int(max_bytes // max(cb.shape[1] * 8, 1)))
+        for start in range(0, len(flat), step):
+            diff = flat[start:start + step].astype(np.float32) - cb[chosen[start:start + step]]
+            total += float((diff ** 2).sum() if metric == "l2" else np.abs(diff).sum())
+        return total
+
+    approx_error = total_error(labels)
+    exact_error = total_error(exact)
+
+    return {
+        'blocks': len(flat),
+        'differ': differ,
+        'differ_fraction': differ / len(flat) if len(flat) else 0.0,
+        'distortion_increase': approx_error / exact_error - 1.0 if exact_error else 0.0
+    }
+
+
+@traced("assign")
+def assign_codewords(flat, codebook, metric="l1", n_probe=None, search="full", max_bytes=DEFAULT_MAX_BYTES,
+                     progress=None, dtype=None):
+    """Nearest codeword per row of flat, by the exact search named by search or approximately
+
+    n_probe selects indexed_codeword for codebooks of INDEX_MIN_CODEWORDS or
+    more; otherwise search is "full" (nearest_codeword) or "pruned"
+    (pruned_codeword, which pays off for l1 on large blocks). dtype is
+    passed on to nearest_codeword.
+    """
+    if search not in SEARCHES:
+        raise ValueError(f"Unknown search: {search!r}")
+    if n_probe is None or len(codebook) < INDEX_MIN_CODEWORDS:
+        if search == "pruned":
+            return pruned_codeword(flat, codebook, metric, max_bytes, progress)
+        return nearest_codeword(flat, codebook, metric, max_bytes, progress, dtype)
+    return indexed_codeword(flat, build_index(codebook), n_probe, metric, max_bytes, progress)
+
+
+def partial_distance(x, c, best, metric="l1", n_chunks=PDE_CHUNKS):
+    """Row-wise distance between x and c, abandoning rows as soon as they exceed best
+
+    Dimensions are summed a chunk at a time; rows whose running total is
+    already above best are dropped from the remaining chunks, so their
+    returned value is only a lower bound (still above best).
+    """
+    dim = x.shape[1]
+    edges = np.linspace(0, dim, min(n_chunks, dim) + 1).astype(int)
+    total = np.zeros(len(x), dtype=np.float32)
+    alive = np.arange(len(x))
+    for a, b in zip(edges[:-1], edges[1:]):
+        diff = x[alive, a:b] - c[alive, a:b]
+        total[alive] += (diff * diff).sum(axis=1) if metric == "l2" else np.abs(diff).sum(axis=1)
+        alive = alive[total[alive] <= best[alive]]
+        if not len(alive):
+            break
+    return total
+
+
+def pruned_codeword(flat, codebook, metric="l1", max_bytes=DEFAULT_MAX_BYTES, progress=None):
+    """Exact nearest codeword for every row of flat, skipping codewords that provably lose
+
+    Codewords are sorted by the sum of their values and each block searches
+    outwards from the codeword whose sum is closest to its own. The gap
+    between sums is a lower bound on the distance (|sum x - sum c| for l1,
+    (sum x - sum c)^2 / dim for squared l2), so each side stops as soon as
+    the bound passes the best distance found so far. The same bound over
+    BOUND_GROUPS sub-vector sums then rules out most remaining candidates
+    without touching their pixels. Others are skipped by the triangle
+    inequality when they lie more than twice the best distance away from
+    the current best codeword (see codeword_distances), and the rest are
+    compared with partial distance elimination. Ties go to the lowest
+    codeword index, as in nearest_codeword.
+    """
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric: {metric!r}")
+
+    flat = flat.reshape(len(flat), -1)
+    n_blocks, dim = flat.shape
+    cb = np.asarray(codebook, dtype=np.float32).reshape(len(codebook), -1)
+    n_clusters = len(cb)
+    if cb.shape[1] != dim:
+        raise ValueError(f"Codeword size {cb.shape[1]} does not match block size {dim}")
+
+    order = np.argsort(cb.sum(axis=1), kind="stable")
+    cb = cb[order]
+    sums = cb.sum(axis=1)
+
+    # distances between codewords in true metric units, if they fit in the budget
+    between = codeword_distances(cb, metric, max_bytes)
+
+    edges = np.linspace(0, dim, min(BOUND_GROUPS, dim) + 1).astype(int)
+    group_len = np.diff(edges).astype(np.float32)
+    cb_groups = np.add.reduceat(cb, edges[:-1], axis=1)
+
+    def lower_bound(x_sum, c_sum, size=dim):
+        gap = np.abs(x_sum - c_sum)
+        return gap * gap / size if metric == "l2" else gap
+
+    labels = np.empty(n_blocks, dtype=np.intp)
+    step = max(1, int(max_bytes // (4 * dim * 4)))
+    for start in range(0, n_blocks, step):
+        x = flat[start:start + step].astype(np.float32)
+        x_sum = x.sum(axis=1)
+        x_groups = np.add.reduceat(x, edges[:-1], axis=1)
+        rows = np.arange(len(x))
+
+        best = np.minimum(np.searchsorted(sums, x_sum), n_clusters - 1)
+        best_dist = partial_distance(x, cb[best], np.full(len(x), np.inf, dtype=np.float32), metric)
+
+        for direction in (1, -1):
+            nxt = best + direction
+            active = rows[(nxt >= 0) & (nxt < n_clusters)]
+            while len(active):
+                j = nxt[active]
+                # along a side the sum gap only grows, so the bound retires the block for good
+                keep = lower_bound(x_sum[active], sums[j]) <= best_dist[active]
+                active, j = active[keep], j[keep]
+                # the same bound summed over sub-vectors is tighter and still cheap
+                near = lower_bound(x_groups[active], cb_groups[j], group_len).sum(axis=1) <= best_dist[active]
+                check, cj = active[near], j[near]
+                if between is not None and len(check):
+                    limit = 2 * (np.sqrt(best_dist[check]) if metric == "l2" else best_dist[check])
+                    near = between[best[check], cj] <= limit
+                    check, cj = check[near], cj[near]
+                if len(check):
+                    dist = partial_distance(x[check], cb[cj], best_dist[check], metric)
+                    tie = (dist == best_dist[check]) & (order[cj] < order[best[check]])
+                    better = (dist < best_dist[check]) | tie
+                    best_dist[check[better]] = dist[better]
+                    best[check[better]] = cj[better]
+                nxt[active] += direction
+                active = active[(nxt[active] >= 0) & (nxt[active] < n_clusters)]
+
+        labels[start:start + step] = order[best]
+        if progress is not None:
+            progress(min(start + step, n_blocks), n_blocks)
+
+    return labels
@@ -0,0 +1,258 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from PIL import Image
+
+import vq_cache
+import vq_codec
+import vq_format
+import vq_shared
+import vq_stream
+import vq_train
+from vq_assign import COMPUTE_DTYPES, INDEX_MIN_CODEWORDS, SEARCHES, compare_assignments
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+
+def find_images(inputs):
+    """Expand directories and glob patterns into a sorted list of image paths"""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            candidates = [os.path.join(item, name) for name in os.listdir(item)]
+        else:
+            candidates = glob.glob(item)
+        paths.extend(p for p in candidates if os.path.isfile(p) and p.lower().endswith(IMAGE_EXTENSIONS))
+    return sorted(set(paths))
+
+
+def output_path(image_path, output_dir):
+    """Path of the .bin file written for image_path"""
+    name = os.path.splitext(os.path.basename(image_path))[0] + ".bin"
+    return os.path.join(output_dir or os.path.dirname(image_path), name)
+
+
+def compress_file(image_path, bin_path, block_w, block_h, n_clusters, mode=vq_codec.DEFAULT_MODE,
+                  label_coding=vq_format.DEFAULT_LABEL_CODING, stream=False, cache_dir=None, shared=None,
+                  stages=vq_codec.DEFAULT_STAGES, n_probe=None, probe_report=False, search="full",
+                  dtype=None):
+    """Compress one image to a .bin file and return its summary record
+
+    With probe_report, the stored labels are compared with exhaustive search
+    over the stored codebook under the record's 'probe' key.
+    """
+    start = time.perf_counter()
+    try:
+        if shared is not None:
+            image = np.array(Image.open(image_path).convert("RGB"))
+            data = vq_shared.encode_shared(image, shared)
+            vq_format.save_compressed(data, bin_path, label_coding)
+        elif stream:
+            data = vq_stream.encode_stream(image_path, bin_path, block_w, block_h, n_clusters, mode,
+                                           label_coding=label_coding)
+        else:
+            image = np.array(Image.open(image_path).convert("RGB"))
+            cache = vq_cache.CodebookCache(directory=cache_dir) if cache_dir else None
+            data = vq_codec.encode(image, block_w, block_h, n_clusters, mode, cache, stages, n_probe, search,
+                                   dtype)
+            vq_format.save_compressed(data, bin_path, label_coding)
+        compressed = os.path.getsize(bin_path)
+        record = {
+            'input': image_path,
+            'output': bin_path,
+            'ok': True,
+            'original_bytes': vq_codec.raw_size(data),
+            'compressed_bytes': compressed,
+            'ratio': vq_codec.raw_size(data) / compressed,
+            'seconds': time.perf_counter() - start
+        }
+        if probe_report and n_probe is not None and not stream and shared is None:
+            record['probe'] = probe_accuracy(image, data, vq_codec.default_metric(mode))
+        return record
+    except Exception as e:
+        return {
+            'input': image_path,
+            'output': bin_path,
+            'ok': False,
+            'error': str(e),
+            'seconds': time.perf_counter() - start
+        }
+
+
+def probe_accuracy(image, data, metric):
+    """compare_assignments for the labels written to the file against exact search over its codebook"""
+    codebook = data['codebook']
+    if data.get('layout') or len(codebook) < INDEX_MIN_CODEWORDS:
+        return None
+    blocks, _ = vq_codec.image_blocks(vq_codec.as_rgb_array(image), data['block_w'], data['block_h'])
+    flat = blocks.reshape(len(data['labels']), -1)
+    return compare_assignments(flat, codebook.reshape(len(codebook), -1), data['labels'], metric)
+
+
+def single_core_training():
+    """Pool initializer: files already run in parallel, so k-means should not fan out again"""
+    vq_train.TRAIN_WORKERS = 1
+
+
+def run_batch(paths, output_dir=None, block_w=vq_codec.DEFAULT_BLOCK_W, block_h=vq_codec.DEFAULT_BLOCK_H,
+              n_clusters=vq_codec.DEFAULT_CLUSTERS, mode=vq_codec.DEFAULT_MODE,
+              label_coding=vq_format.DEFAULT_LABEL_CODING, stream=False, cache_dir=None, shared=None,
+              workers=None, on_result=None, stages=vq_codec.DEFAULT_STAGES, n_probe=None, probe_report=False,
+              search="full", dtype=None):
+    """Compress every path in a process pool and return the records in input order"""
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    records = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=single_core_training) as pool:
+        futures = {
+            pool.submit(compress_file, path, output_path(path, output_dir), block_w, block_h, n_clusters,
+                        mode, label_coding, stream, cache_dir, shared, stages, n_probe, probe_report,
+                        search, dtype): path
+            for path in paths
+        }
+        for future in as_completed(futures):
+            record = future.result()
+            records[futures[future]] = record
+            if on_result is not None:
+                on_result(record)
+
+    return [records[path] for path in paths]
+
+
+def print_record(record):
+    """Print a one-line result for a finished file"""
+    if record['ok']:
+        line = f"{record['input']}: {record['ratio']:.2f}:1 in {record['seconds']:.2f}s"
+        if record.get('probe'):
+            line += f", {record['probe']['differ']} blocks differ from exact search"
+        print(line)
+    else:
+        print(f"{record['input']}: FAILED ({record['error']})", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compress many images to .bin files with vector quantization")
+    parser.add_argument("inputs", nargs="+", help="image files, directories or glob patterns")
+    parser.add_argument("-o", "--output-dir", help="directory for .bin files (default: next to each image)")
+    parser.add_argument("-W", "--block-w", type=int, default=vq_codec.DEFAULT_BLOCK_W, help="block width")
+    parser.add_argument("-H", "--block-h", type=int, default=vq_codec.DEFAULT_BLOCK_H, help="block height")
+    parser.add_argument("-k", "--clusters", type=int, default=vq_codec.DEFAULT_CLUSTERS, help="number of codewords")
+    parser.add_argument("-m", "--mode", choices=vq_codec.QUANTIZER_MODES, default=vq_codec.DEFAULT_MODE,
+                        help="codebook training mode")
+    parser.add_argument("--stages", type=int, default=vq_codec.DEFAULT_STAGES,
+                        help="sub-vectors (product mode) or stages (residual mode) per block")
+    parser.add_argument("--search", choices=SEARCHES, default="full",
+                        help="exact codeword search: brute force, or pruned by block-sum lower bounds, "
+                             "the triangle inequality and partial distances")
+    parser.add_argument("--compute-dtype", choices=COMPUTE_DTYPES, default=None,
+                        help="dtype for L1 distances; int16 compares blocks with the stored uint8 codewords "
+                             "(default: int16 when that is exact, else float32)")
+    parser.add_argument("--probe", type=int, default=None,
+                        help=f"search codebooks of {INDEX_MIN_CODEWORDS}+ codewords approximately, "
+                             f"probing this many index buckets per block (more is slower but closer to exact)")
+    parser.add_argument("--probe-report", action="store_true",
+                        help="also run exact search and report how many assignments differ")
+    parser.add_argument("--label-coding", choices=vq_format.LABEL_CODINGS, default=vq_format.DEFAULT_LABEL_CODING,
+                        help="how labels are stored in the .bin file")
+    parser.add_argument("--stream", action="store_true",
+                        help="encode strip by strip with a sampled codebook to bound memory on huge images")
+    parser.add_argument("--cache-dir", help="reuse codebooks for identical images and settings from this directory")
+    parser.add_argument("--codebook", help="encode against this shared .vqcb codebook (its block size is used)")
+    parser.add_argument("--train-codebook", action="store_true",
+                        help="train one shared codebook on all inputs, save it as <id>.vqcb and encode against it")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--summary", help="write per-file results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    try:
+        vq_codec.check_block_size(args.block_w, args.block_h)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.clusters <= 0:
+        parser.error("Number of codewords must be positive!")
+    if args.stream and args.label_coding not in vq_stream.STREAM_LABEL_CODINGS:
+        parser.error(f"--stream supports label coding {', '.join(vq_stream.STREAM_LABEL_CODINGS)}")
+
+    if args.codebook and args.train_codebook:
+        parser.error("use either --codebook or --train-codebook")
+    if (args.codebook or args.train_codebook) and (args.stream or args.label_coding == "raw"):
+        parser.error("shared codebooks cannot be combined with --stream or raw label coding")
+    if (args.codebook or args.train_codebook) and (args.search != "full" or args.compute_dtype is not None):
+        parser.error("shared codebooks cannot be combined with --search or --compute-dtype")
+    if args.probe is not None and args.probe <= 0:
+        parser.error("--probe must be positive")
+    if args.compute_dtype == "int16" and (args.mode in vq_codec.L2_MODES or args.mode in vq_codec.STAGE_MODES):
+        parser.error(f"--compute-dtype int16 only applies to L1 distances, not -m {args.mode}")
+    if args.probe is not None:
+        if args.mode == "tree":
+            parser.error("--probe does not apply to -m tree, which assigns blocks by walking the tree")
+        if args.mode in vq_codec.STAGE_MODES:
+            parser.error(f"--probe does not apply to -m {args.mode}, whose per-stage codebooks are small")
+        if args.stream or args.codebook or args.train_codebook:
+            parser.error("--probe cannot be combined with --stream or shared codebooks")
+    if args.mode in vq_codec.STAGE_MODES:
+        if args.stages < 2:
+            parser.error("--stages must be at least 2")
+        if args.stream or args.codebook or args.train_codebook or args.label_coding == "raw":
+            parser.error(f"--mode {args.mode} cannot be combined with --stream, shared codebooks "
+                         f"or raw label coding")
+
+    paths = find_images(args.inputs)
+    if not paths:
+        parser.error("no images found")
+
+    start = time.perf_counter()
+    shared = None
+    if args.codebook:
+        try:
+            shared = vq_format.load_codebook(args.codebook)
+        except (OSError, ValueError) as e:
+            parser.error(f"cannot load codebook {args.codebook}: {e}")
+        args.block_w, args.block_h = shared['block_w'], shared['block_h']
+    elif args.train_codebook:
+        shared = vq_shared.train_shared_codebook(paths, args.block_w, args.block_h, args.clusters, args.mode)
+        codebook_dir = args.output_dir or os.path.dirname(paths[0])
+        os.makedirs(codebook_dir, exist_ok=True)
+        codebook_path = os.path.join(codebook_dir, vq_format.codebook_filename(shared['codebook_id']))
+        vq_format.save_codebook(shared, codebook_path)
+        print(f"shared codebook: {codebook_path}")
+
+    records = run_batch(paths, args.output_dir, args.block_w, args.block_h, args.clusters,
+                        args.mode, args.label_coding, args.stream, args.cache_dir, shared, args.workers,
+                        on_result=print_record, stages=args.stages, n_probe=args.probe,
+                        probe_report=args.probe_report, search=args.search,
+                        dtype=args.compute_dtype)
+    elapsed = time.perf_counter() - start
+
+    done = [r for r in records if r['ok']]
+    total_in = sum(r['original_bytes'] for r in done)
+    total_out = sum(r['compressed_bytes'] for r in done)
+    overall = total_in / total_out if total_out else 0.0
+    print(f"{len(done)}/{len(records)} images compressed in {elapsed:.2f}s, overall ratio {overall:.2f}:1")
+
+    if args.summary:
+        with open(args.summary, 'w') as f:
+            json.dump({
+                'block_w': args.block_w,
+                'block_h': args.block_h,
+                'n_clusters': args.clusters,
+                'mode': args.mode,
+                'label_coding': args.label_coding,
+                'codebook_id': shared['codebook_id'] if shared else None,
+                'seconds': elapsed,
+                'ratio': overall,
+                'files': records
+            }, f, indent=2)
+
+    return 0 if len(done) == len(records) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
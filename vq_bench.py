@@ -0,0 +1,206 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image
+
+import vq_codec
+import vq_format
+
+DEFAULT_SIZES = ("512x512", "1920x1080")
+DEFAULT_BLOCK_SIZES = ("4x4", "8x8")
+DEFAULT_CLUSTER_COUNTS = (64, 256)
+RESULTS_VERSION = 3
+STAGES = ("blocks", "quantize", "reconstruct", "save", "load", "decode")
+
+
+def parse_size(text):
+    """'WxH' -> (w, h)"""
+    try:
+        w, h = (int(v) for v in text.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected WxH, got {text!r}")
+    if w <= 0 or h <= 0:
+        raise argparse.ArgumentTypeError(f"size must be positive, got {text!r}")
+    return w, h
+
+
+def synthetic_image(width, height, seed=0):
+    """Photo-like RGB test image: smooth gradients and shapes with some texture and noise"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    x /= max(width, 1)
+    y /= max(height, 1)
+    image = np.stack([
+        128 + 100 * np.sin(6 * x + 4 * y),
+        128 + 90 * np.cos(5 * y) * np.sin(3 * x),
+        255 * (x + y) / 2
+    ], axis=2)
+    image[((x - 0.6) ** 2 + (y - 0.4) ** 2) < 0.04] = (230, 60, 40)
+    image += 12 * np.sin(80 * x)[..., None] * np.sin(60 * y)[..., None]
+    image += rng.normal(0, 4, image.shape).astype(np.float32)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def psnr(original, reconstructed):
+    """Peak signal-to-noise ratio in dB between two uint8 images"""
+    mse = np.mean((original.astype(np.float64) - reconstructed.astype(np.float64)) ** 2)
+    return float("inf") if mse == 0 else float(10 * np.log10(255.0 ** 2 / mse))
+
+
+def measure(fn, repeat=1, memory=True):
+    """Run fn, returning (result, best wall seconds over repeat runs, peak traced bytes or None)
+
+    Timed runs happen without tracemalloc; the peak comes from one more
+    traced run so that tracing overhead does not skew the times.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            fn()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result, best, peak
+
+
+def bench_case(image, name, block_w, block_h, n_clusters, mode=vq_codec.DEFAULT_MODE,
+               label_coding=vq_format.DEFAULT_LABEL_CODING, repeat=1, memory=True, workdir=None):
+    """Run every pipeline stage on one image and return its timing, memory and quality record"""
+    h, w = image.shape[:2]
+    stages = {}
+
+    def run(stage, fn):
+        result, seconds, peak = measure(fn, repeat, memory)
+        stages[stage] = {'seconds': seconds, 'peak_bytes': peak}
+        return result
+
+    blocks, padded_size = run("blocks", lambda: vq_codec.image_blocks(image, block_w, block_h))
+    if memory:
+        # the separate pad + split path, for comparison with the blocks stage
+        padded_split = measure(lambda: vq_codec.split_blocks(vq_codec.pad_image(image, block_w, block_h)[0],
+                                                             block_w, block_h), 1, True)[2]
+    codebook, labels = run("quantize", lambda: vq_codec.quantize(blocks, n_clusters, mode))
+    layout = vq_codec.stage_layout(mode)
+    reconstructed = run("reconstruct", lambda: vq_codec.reconstruct(codebook, labels, block_w, block_h,
+                                                                     padded_size, (w, h), layout=layout))
+    data = {
+        'codebook': codebook,
+        'labels': labels,
+        'block_w': block_w,
+        'block_h': block_h,
+        'padded_size': padded_size,
+        'original_size': (w, h),
+        'layout': layout
+    }
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        path = os.path.join(tmp, "bench.bin")
+        run("save", lambda: vq_format.save_compressed(data, path, label_coding))
+        compressed = os.path.getsize(path)
+        loaded = run("load", lambda: vq_format.load_compressed(path))
+        run("decode", lambda: vq_codec.decode(loaded))
+
+    total = sum(s['seconds'] for s in stages.values())
+    return {
+        'image': name,
+        'width': w,
+        'height': h,
+        'block_w': block_w,
+        'block_h': block_h,
+        'n_clusters': n_clusters,
+        'mode': mode,
+        'label_coding': label_coding,
+        'stages': stages,
+        'seconds': total,
+        'megapixels_per_s': w * h / 1e6 / total if total else 0.0,
+        'peak_bytes': max((s['peak_bytes'] or 0) for s in stages.values()) if memory else None,
+        'pad_split_peak_bytes': padded_split if memory else None,
+        'compressed_bytes': compressed,
+        'ratio': vq_codec.raw_size(data) / compressed,
+        'psnr': psnr(image, reconstructed)
+    }
+
+
+def load_images(sizes, paths):
+    """(name, image) pairs: a synthetic image per size, then every sample image path"""
+    images = [(f"synthetic-{w}x{h}", synthetic_image(w, h)) for w, h in sizes]
+    for path in paths:
+        images.append((os.path.basename(path), np.array(Image.open(path).convert("RGB"))))
+    return images
+
+
+def print_case(record):
+    times = " ".join(f"{stage}={record['stages'][stage]['seconds'] * 1000:.1f}ms" for stage in STAGES)
+    peak = ""
+    if record['peak_bytes'] is not None:
+        blocks = record['stages']['blocks']['peak_bytes']
+        peak = (f" peak={record['peak_bytes'] / 2 ** 20:.1f}MiB blocks={blocks / 2 ** 20:.1f}MiB"
+                f" (pad+split {record['pad_split_peak_bytes'] / 2 ** 20:.1f}MiB)")
+    print(f"{record['image']} {record['block_w']}x{record['block_h']} k={record['n_clusters']} {record['mode']}: "
+          f"{record['megapixels_per_s']:.2f} MP/s ratio={record['ratio']:.2f} psnr={record['psnr']:.2f}dB{peak}\n"
+          f"    {times}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the vector quantization encode/decode pipeline")
+    parser.add_argument("images", nargs="*", help="sample images to benchmark besides the synthetic ones")
+    parser.add_argument("--sizes", nargs="*", type=parse_size, default=[parse_size(s) for s in DEFAULT_SIZES],
+                        help="synthetic image sizes as WxH (none to skip synthetic images)")
+    parser.add_argument("-b", "--block-sizes", nargs="+", type=parse_size,
+                        default=[parse_size(s) for s in DEFAULT_BLOCK_SIZES], help="block sizes as WxH")
+    parser.add_argument("-k", "--clusters", nargs="+", type=int, default=list(DEFAULT_CLUSTER_COUNTS),
+                        help="codebook sizes")
+    parser.add_argument("-m", "--modes", nargs="+", choices=vq_codec.QUANTIZER_MODES,
+                        default=[vq_codec.DEFAULT_MODE], help="quantizer modes")
+    parser.add_argument("--label-coding", choices=vq_format.LABEL_CODINGS, default=vq_format.DEFAULT_LABEL_CODING,
+                        help="how labels are stored in the .bin file")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="timed runs per stage; the best one counts")
+    parser.add_argument("--no-memory", action="store_true", help="skip the traced run that measures peak memory")
+    parser.add_argument("-o", "--output", help="write results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    if args.repeat <= 0:
+        parser.error("--repeat must be positive")
+    if any(k <= 0 for k in args.clusters):
+        parser.error("Number of codewords must be positive!")
+    images = load_images(args.sizes, args.images)
+    if not images:
+        parser.error("nothing to benchmark")
+
+    cases = []
+    for name, image in images:
+        for block_w, block_h in args.block_sizes:
+            for n_clusters in args.clusters:
+                for mode in args.modes:
+                    record = bench_case(image, name, block_w, block_h, n_clusters, mode, args.label_coding,
+                                        args.repeat, not args.no_memory)
+                    print_case(record)
+                    cases.append(record)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'version': RESULTS_VERSION,
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'platform': platform.platform(),
+                'repeat': args.repeat,
+                'cases': cases
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+import hashlib
+import os
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+import vq_codec
+from vq_assign import INDEX_MIN_CODEWORDS
+
+DEFAULT_MEMORY_BYTES = 256 * 1024 * 1024
+DEFAULT_DISK_BYTES = 1024 * 1024 * 1024
+
+
+def cache_key(blocks, block_w, block_h, n_clusters, mode, stages=vq_codec.DEFAULT_STAGES, n_probe=None,
+              dtype=None, search="full"):
+    """Hex digest identifying a block array and the parameters it is quantized with"""
+    blocks = np.ascontiguousarray(blocks)
+    # n_probe only changes the labels when indexed search actually runs
+    indexed = n_probe is not None and mode not in vq_codec.STAGE_MODES and mode != "tree" \
+        and n_clusters >= INDEX_MIN_CODEWORDS
+    # and dtype only for modes assigned by l1 distance
+    l1 = mode not in vq_codec.STAGE_MODES and vq_codec.default_metric(mode) == "l1"
+    if mode in vq_codec.STAGE_MODES:
+        mode = f"{mode}:{stages}"
+    if indexed:
+        mode = f"{mode}~{n_probe}"
+    if dtype is not None and l1:
+        mode = f"{mode}@{dtype}"
+    # exact searches agree only up to float32 rounding on near-ties, so each gets its own entries
+    if search != "full":
+        mode = f"{mode}/{search}"
+    h = hashlib.blake2b(digest_size=20)
+    h.update(f"{blocks.shape}|{blocks.dtype.str}|{block_w}|{block_h}|{n_clusters}|{mode}".encode())
+    h.update(memoryview(blocks).cast('B'))
+    return h.hexdigest()
+
+
+class CodebookCache:
+    """LRU cache of (codebook, labels) results, bounded in bytes, optionally backed by a directory
+
+    Entries evicted from memory stay on disk when a directory is given; the
+    directory is trimmed to max_disk_bytes by dropping the least recently
+    used files. Returned arrays are read-only.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MEMORY_BYTES, directory=None, max_disk_bytes=DEFAULT_DISK_BYTES):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def get(self, key):
+        """Cached (codebook, labels) for key, or None"""
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+        if self.directory and os.path.exists(self.path(key)):
+            try:
+                with np.load(self.path(key)) as f:
+                    entry = self.remember(key, f['codebook'], f['labels'])
+                os.utime(self.path(key))
+                self.hits += 1
+                return entry
+            except (OSError, ValueError, KeyError):
+                pass
+
+        self.misses += 1
+        return None
+
+    def put(self, key, codebook, labels):
+        """Store a result in memory and, if configured, on disk"""
+        entry = self.remember(key, codebook, labels)
+        if self.directory:
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, codebook=entry[0], labels=entry[1])
+            os.replace(tmp, self.path(key))
+            self.trim_disk()
+        return entry
+
+    def remember(self, key, codebook, labels):
+        codebook = np.array(codebook)
+        labels = np.array(labels)
+        codebook.flags.writeable = False
+        labels.flags.writeable = False
+        nbytes = codebook.nbytes + labels.nbytes
+
+        if key in self.entries:
+            old = self.entries.pop(key)
+            self.size -= old[0].nbytes + old[1].nbytes
+        if nbytes > self.max_bytes:
+            return codebook, labels
+
+        self.entries[key] = (codebook, labels)
+        self.size += nbytes
+        while self.size > self.max_bytes:
+            _, (old_codebook, old_labels) = self.entries.popitem(last=False)
+            self.size -= old_codebook.nbytes + old_labels.nbytes
+        return codebook, labels
+
+    def trim_disk(self):
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".npz"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in files)
+        for _, size, name in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def quantize(self, blocks, n_clusters=vq_codec.DEFAULT_CLUSTERS, mode=vq_codec.DEFAULT_MODE, progress=None,
+                 stages=vq_codec.DEFAULT_STAGES, n_probe=None, search="full", dtype=None, train_progress=None):
+        """vq_codec.quantize, answered from the cache when the same blocks were seen before"""
+        block_h, block_w = blocks.shape[1:3]
+        key = cache_key(blocks, block_w, block_h, n_clusters, mode, stages, n_probe, dtype, search)
+        entry = self.get(key)
+        if entry is not None:
+            return entry
+        codebook, labels = vq_codec.quantize(blocks, n_clusters, mode, progress=progress, stages=stages,
+                                            n_probe=n_probe, search=search, dtype=dtype,
+                                            train_progress=train_progress)
+        return self.put(key, codebook, labels)
@@ -0,0 +1,395 @@
+import numpy as np
+
+import vq_train
+from vq_assign import INDEX_MIN_CODEWORDS, assign_codewords, compute_dtype, nearest_codeword, tree_codeword
+from vq_trace import traced
+
+DEFAULT_BLOCK_W = 8
+DEFAULT_BLOCK_H = 8
+DEFAULT_CLUSTERS = 256
+DEFAULT_MODE = "mean-split"
+QUANTIZER_MODES = ("mean-split", "minibatch", "kmeans", "tree", "product", "residual")
+# Modes whose codebooks are trained as squared-L2 centroids
+L2_MODES = ("minibatch", "kmeans", "tree")
+# Modes that describe each block with one label per stage instead of a single label
+STAGE_MODES = ("product", "residual")
+DEFAULT_STAGES = 4
+# Residual stages after the first store signed corrections offset by this much
+RESIDUAL_BIAS = 128
+DECODE_STRIP_BYTES = 8 * 1024 * 1024
+PREVIEW_SIZE = (500, 400)
+# Blocks the preview codebook is trained on; assignment still covers the whole downscaled image
+PREVIEW_SAMPLE_BLOCKS = 4096
+
+
+def check_block_size(block_w, block_h):
+    """Raise ValueError unless both block dimensions are positive integers"""
+    if int(block_w) != block_w or int(block_h) != block_h:
+        raise ValueError("Block width and height must be integers!")
+    if block_w <= 0 or block_h <= 0:
+        raise ValueError("Block width and height must be positive!")
+
+
+def as_rgb_array(image):
+    """Return image as an HxWx3 uint8 array"""
+    arr = np.asarray(image)
+    if arr.ndim != 3 or arr.shape[2] != 3:
+        raise ValueError(f"Expected an HxWx3 RGB image, got shape {arr.shape}")
+    if arr.dtype != np.uint8:
+        arr = arr.astype(np.uint8)
+    return arr
+
+
+@traced("pad")
+def pad_image(image, block_w, block_h):
+    """Edge-pad an image so its sides are multiples of the block size"""
+    check_block_size(block_w, block_h)
+    h, w = image.shape[:2]
+    pad_h = (block_h - (h % block_h)) % block_h
+    pad_w = (block_w - (w % block_w)) % block_w
+
+    if pad_h > 0 or pad_w > 0:
+        image = np.pad(image, ((0, pad_h), (0, pad_w), (0, 0)), mode='edge')
+
+    return image, (w + pad_w, h + pad_h)
+
+
+@traced("split")
+def split_blocks(image, block_w, block_h):
+    """Split a padded image into an array of (n_blocks, block_h, block_w, 3) blocks"""
+    h, w, c = image.shape
+    if h % block_h or w % block_w:
+        raise ValueError("Image size must be a multiple of the block size, pad it first")
+    blocks = image.reshape(h // block_h, block_h, w // block_w, block_w, c)
+    return blocks.swapaxes(1, 2).reshape(-1, block_h, block_w, c)
+
+
+def block_view(image, block_w, block_h):
+    """(rows, cols, block_h, block_w, 3) strided view of the whole blocks of an image; nothing is copied
+
+    Partial blocks at the right and bottom edges are left out.
+    """
+    h, w, c = image.shape
+    rows, cols = h // block_h, w // block_w
+    blocks = image[:rows * block_h, :cols * block_w].reshape(rows, block_h, cols, block_w, c)
+    return blocks.swapaxes(1, 2)
+
+
+@traced("split")
+def image_blocks(image, block_w, block_h):
+    """Blocks of an image edge-padded to whole blocks, as (blocks, padded_size)
+
+    Gives the same blocks as split_blocks(pad_image(...)), but the returned
+    (n_blocks, block_h, block_w, 3) array is the only full-size allocation.
+    Whole blocks are copied into it straight from a block_view, and only
+    the partial strips along the right and bottom edges are padded.
+    """
+    check_block_size(block_w, block_h)
+    h, w, c = image.shape
+    rows, cols = -(-h // block_h), -(-w // block_w)
+    whole_rows, whole_cols = h // block_h, w // block_w
+    blocks = np.empty((rows, cols, block_h, block_w, c), dtype=image.dtype)
+    blocks[:whole_rows, :whole_cols] = block_view(image, block_w, block_h)
+    if whole_cols < cols:
+        strip, _ = pad_image(image[:, whole_cols * block_w:], block_w, block_h)
+        blocks[:, whole_cols:] = block_view(strip, block_w, block_h)
+    if whole_rows < rows:
+        strip, _ = pad_image(image[whole_rows * block_h:, :whole_cols * block_w], block_w, block_h)
+        blocks[whole_rows:, :whole_cols] = block_view(strip, block_w, block_h)
+    return blocks.reshape(-1, block_h, block_w, c), (cols * block_w, rows * block_h)
+
+
+def check_mode(mode):
+    """Raise ValueError for an unknown quantizer mode"""
+    if mode not in QUANTIZER_MODES:
+        raise ValueError(f"Unknown quantizer mode: {mode!r}")
+
+
+def default_metric(mode):
+    """Distance used to assign blocks for the given quantizer mode"""
+    return "l2" if mode in L2_MODES else "l1"
+
+
+def stage_layout(mode):
+    """Codebook layout written for mode: None for a single codebook, else the mode name"""
+    return mode if mode in STAGE_MODES else None
+
+
+@traced("train")
+def train_codebook(flat, n_clusters, mode=DEFAULT_MODE, progress=None):
+    """Float32 codebook trained on flattened blocks
+
+    progress, if given, is called as progress(done, total) per batch,
+    iteration or tree split, depending on the mode.
+    """
+    check_mode(mode)
+    if mode in STAGE_MODES:
+        raise ValueError(f"The {mode!r} quantizer has one codebook per stage and cannot be trained as one")
+    if mode == "minibatch":
+        return vq_train.minibatch_kmeans(flat, n_clusters, progress=progress)
+    if mode == "kmeans":
+        return vq_train.kmeans(flat, n_clusters, progress=progress)
+    if mode == "tree":
+        return vq_train.build_tree(flat, n_clusters, progress=progress)['codebook']
+    return vq_train.mean_split_codebook(flat, n_clusters)
+
+
+def codebook_to_uint8(codebook, mode=DEFAULT_MODE):
+    """Convert a trained float codebook to the stored uint8 codewords"""
+    if mode in L2_MODES:
+        codebook = np.rint(codebook)
+    return codebook.astype(np.uint8)
+
+
+def quantize_stages(flat, n_clusters, mode, stages=DEFAULT_STAGES, progress=None, train_progress=None):
+    """Train a product or residual quantizer on flattened blocks and assign every block
+
+    "product" splits each block vector into `stages` equal sub-vectors with a
+    codebook each; "residual" codes each block as the sum of one codeword per
+    stage, every stage being trained on what the previous ones left over.
+    Returns a (stages, n_clusters, sub_dim) uint8 codebook and
+    (n_blocks, stages) labels, giving n_clusters ** stages effective codewords.
+    """
+    if mode not in STAGE_MODES:
+        raise ValueError(f"Not a multi-stage quantizer mode: {mode!r}")
+    if stages < 2:
+        raise ValueError("Multi-stage quantizers need at least 2 stages!")
+    n_blocks, dim = flat.shape
+    labels = np.empty((n_blocks, stages), dtype=np.intp)
+
+    def stage_progress(stage, callback=progress):
+        if callback is None:
+            return None
+        return lambda done, total: callback(stage * total + done, stages * total)
+
+    if mode == "product":
+        if dim % stages:
+            raise ValueError(f"A block of {dim} values cannot be split into {stages} equal sub-vectors")
+        sub_dim = dim // stages
+        codebook = np.empty((stages, n_clusters, sub_dim), dtype=np.uint8)
+        for stage in range(stages):
+            part = flat[:, stage * sub_dim:(stage + 1) * sub_dim]
+            trained = vq_train.minibatch_kmeans(part, n_clusters, progress=stage_progress(stage, train_progress))
+            labels[:, stage] = nearest_codeword(part, trained, metric="l2", progress=stage_progress(stage))
+            codebook[stage] = codebook_to_uint8(trained, "minibatch")
+        return codebook, labels
+
+    residual = flat.astype(np.float32)
+    codebook = np.empty((stages, n_clusters, dim), dtype=np.uint8)
+    for stage in range(stages):
+        trained = vq_train.minibatch_kmeans(residual, n_clusters, progress=stage_progress(stage, train_progress))
+        labels[:, stage] = nearest_codeword(residual, trained, metric="l2", progress=stage_progress(stage))
+        bias = 0 if stage == 0 else RESIDUAL_BIAS
+        # subtract exactly what the decoder will add back, not the float codewords
+        step = np.clip(np.rint(trained), -bias, 255 - bias)
+        residual -= step[labels[:, stage]]
+        codebook[stage] = step + bias
+    return codebook, labels
+
+
+@traced("quantize")
+def quantize(blocks, n_clusters=DEFAULT_CLUSTERS, mode=DEFAULT_MODE, metric=None, progress=None,
+             stages=DEFAULT_STAGES, n_probe=None, search="full", dtype=None, train_progress=None):
+    """Build a codebook from blocks and assign every block to its nearest codeword
+
+    progress is passed on to the assignment pass and train_progress to
+    training; either may raise to abort the run. In "tree" mode blocks are
+    assigned by descending the tree unless a metric is given, in which case
+    the leaves are searched exhaustively; the tree may have fewer leaves than
+    n_clusters when the blocks run out of distinct values. Product and
+    residual modes return per-stage codebooks and labels from quantize_stages.
+    n_probe switches large codebooks to approximate search through an
+    inverted-file index over the stored uint8 codewords; it cannot be
+    combined with tree descent or multi-stage modes. search picks the exact
+    search used otherwise (see vq_assign.assign_codewords). dtype="int16"
+    computes l1 distances in integers against the stored uint8 codewords
+    rather than the float ones.
+    """
+    if n_clusters <= 0:
+        raise ValueError("Number of codewords must be positive!")
+    check_mode(mode)
+    n_blocks, bh, bw, c = blocks.shape
+    flat = blocks.reshape(n_blocks, -1)
+    n_clusters = min(n_clusters, n_blocks)
+
+    if n_probe is not None and mode in STAGE_MODES:
+        raise ValueError(f"n_probe does not apply to the {mode!r} quantizer")
+    if mode in STAGE_MODES:
+        return quantize_stages(flat, n_clusters, mode, stages, progress, train_progress)
+    if mode == "tree" and metric is None:
+        if n_probe is not None:
+            raise ValueError("n_probe does not apply to tree descent; give a metric to search the leaves")
+        tree = vq_train.build_tree(flat, n_clusters, progress=train_progress)
+        codebook = tree['codebook']
+        labels = tree_codeword(flat, tree, progress=progress)
+    else:
+        metric = metric or default_metric(mode)
+        codebook = train_codebook(flat, n_clusters, mode, train_progress)
+        # indexed search runs on the stored codewords so that its labels can be checked against exact search
+        indexed = n_probe is not None and len(codebook) >= INDEX_MIN_CODEWORDS
+        if indexed or compute_dtype(flat, codebook, metric, dtype) == "int16":
+            codebook = codebook_to_uint8(codebook, mode)
+        labels = assign_codewords(flat, codebook, metric, n_probe, search, progress=progress, dtype=dtype)
+    codebook = codebook_to_uint8(codebook, mode).reshape(len(codebook), bh, bw, c)
+
+    return codebook, labels
+
+
+def strip_block_rows(padded_w, block_h, max_bytes=DECODE_STRIP_BYTES):
+    """Rows of blocks per reconstructed strip so a strip and its gather stay under max_bytes"""
+    return max(1, max_bytes // max(2 * padded_w * block_h * 3, 1))
+
+
+def lookup_blocks(codebook, labels, layout=None):
+    """Decoded blocks for labels, flattened for multi-stage layouts
+
+    With a single codebook this is codebook[labels]; "product" codebooks
+    concatenate one sub-vector per stage and "residual" ones add up the
+    stages, clipping the sum to the pixel range.
+    """
+    if layout is None:
+        return codebook[labels]
+    if layout == "product":
+        return np.concatenate([codebook[stage][labels[:, stage]] for stage in range(len(codebook))], axis=1)
+    if layout == "residual":
+        total = codebook[0][labels[:, 0]].astype(np.int16)
+        for stage in range(1, len(codebook)):
+            total += codebook[stage][labels[:, stage]]
+            total -= RESIDUAL_BIAS
+        return np.clip(total, 0, 255).astype(np.uint8)
+    raise ValueError(f"Unknown codebook layout: {layout!r}")
+
+
+def reconstruct_strips(codebook, labels, block_w, block_h, padded_size, original_size, block_rows=1,
+                       layout=None):
+    """Yield (y0, rows) of the cropped reconstruction, block_rows rows of blocks at a time"""
+    w_blocks = padded_size[0] // block_w
+    h_blocks = padded_size[1] // block_h
+    if w_blocks * h_blocks != len(labels):
+        raise ValueError(f"Expected {w_blocks * h_blocks} labels, got {len(labels)}")
+    orig_w, orig_h = original_size
+
+    for r0 in range(0, h_blocks, block_rows):
+        y0 = r0 * block_h
+        if y0 >= orig_h:
+            break
+        r1 = min(r0 + block_rows, h_blocks)
+        strip = lookup_blocks(codebook, labels[r0 * w_blocks:r1 * w_blocks], layout)
+        strip = strip.reshape(r1 - r0, w_blocks, block_h, block_w, 3)
+        strip = strip.swapaxes(1, 2).reshape((r1 - r0) * block_h, padded_size[0], 3)
+        yield y0, strip[:orig_h - y0, :orig_w]
+
+
+@traced("reconstruct")
+def reconstruct(codebook, labels, block_w, block_h, padded_size, original_size, out=None, layout=None):
+    """Rebuild the image from codebook and labels, cropped to the original size
+
+    The image is filled strip by strip into out (allocated if not given), so
+    only one strip of padded blocks exists besides the result.
+    """
+    if out is None:
+        out = np.empty((original_size[1], original_size[0], 3), dtype=np.uint8)
+    block_rows = strip_block_rows(padded_size[0], block_h)
+    for y0, rows in reconstruct_strips(codebook, labels, block_w, block_h, padded_size, original_size, block_rows,
+                                       layout):
+        out[y0:y0 + len(rows)] = rows
+
+    return out
+
+
+def downscale(image, factor):
+    """Box-filter an image down by an integer factor, dropping leftover rows and columns"""
+    h, w = image.shape[:2]
+    if factor <= 1 or h < factor or w < factor:
+        return image
+    h2, w2 = h // factor, w // factor
+    view = image[:h2 * factor, :w2 * factor].reshape(h2, factor, w2, factor, 3)
+    return (view.sum(axis=(1, 3), dtype=np.uint32) // (factor * factor)).astype(np.uint8)
+
+
+@traced("preview")
+def preview(image, block_w=DEFAULT_BLOCK_W, block_h=DEFAULT_BLOCK_H, n_clusters=DEFAULT_CLUSTERS,
+            max_size=PREVIEW_SIZE, scale=1, seed=0):
+    """Quick approximate reconstruction at roughly max_size, to show while the full encode runs
+
+    The image is downscaled by the integer factor that brings it near
+    max_size and the block size shrinks by the same factor, so blocks look
+    about as large as they will in the full result shown at that size.
+    scale says how much image is already reduced from the original, e.g.
+    by JPEG draft decoding, so blocks shrink by that much more. Whatever
+    the final mode, the codebook is trained with minibatch k-means on at
+    most PREVIEW_SAMPLE_BLOCKS random blocks, then every block of the
+    downscaled image is assigned to it.
+    """
+    image = as_rgb_array(image)
+    h, w = image.shape[:2]
+    factor = max(1, w // max_size[0], h // max_size[1])
+    small = downscale(image, factor)
+    preview_w = max(1, round(block_w / (factor * scale)))
+    preview_h = max(1, round(block_h / (factor * scale)))
+    blocks, padded_size = image_blocks(small, preview_w, preview_h)
+    flat = blocks.reshape(len(blocks), -1)
+    sample = flat
+    if len(flat) > PREVIEW_SAMPLE_BLOCKS:
+        rng = np.random.default_rng(seed)
+        sample = flat[rng.choice(len(flat), PREVIEW_SAMPLE_BLOCKS, replace=False)]
+    trained = vq_train.minibatch_kmeans(sample, min(n_clusters, len(sample)))
+    labels = nearest_codeword(flat, trained, metric="l2")
+    codebook = codebook_to_uint8(trained, "minibatch").reshape(len(trained), preview_h, preview_w, 3)
+    return reconstruct(codebook, labels, preview_w, preview_h, padded_size, (small.shape[1], small.shape[0]))
+
+
+@traced("encode")
+def encode(image, block_w=DEFAULT_BLOCK_W, block_h=DEFAULT_BLOCK_H, n_clusters=DEFAULT_CLUSTERS,
+           mode=DEFAULT_MODE, cache=None, stages=DEFAULT_STAGES, n_probe=None, search="full", dtype=None):
+    """Compress an RGB image into a dict of codebook, labels and geometry
+
+    cache, if given, is a vq_cache.CodebookCache consulted before quantizing.
+    stages is only used by the product and residual modes; n_probe, search
+    and dtype are as in quantize.
+    """
+    image = as_rgb_array(image)
+    h, w = image.shape[:2]
+    blocks, padded_size = image_blocks(image, block_w, block_h)
+    if cache is not None:
+        codebook, labels = cache.quantize(blocks, n_clusters, mode, stages=stages, n_probe=n_probe, search=search,
+                                          dtype=dtype)
+    else:
+        codebook, labels = quantize(blocks, n_clusters, mode, stages=stages, n_probe=n_probe, search=search,
+                                    dtype=dtype)
+
+    return {
+        'codebook': codebook,
+        'labels': labels,
+        'block_w': block_w,
+        'block_h': block_h,
+        'padded_size': padded_size,
+        'original_size': (w, h),
+        'layout': stage_layout(mode)
+    }
+
+
+@traced("decode")
+def decode(data):
+    """Rebuild the RGB image from a dict produced by encode or vq_format"""
+    check_codebook_loaded(data)
+    return reconstruct(
+        data['codebook'],
+        data['labels'],
+        data['block_w'],
+        data['block_h'],
+        data['padded_size'],
+        data['original_size'],
+        layout=data.get('layout')
+    )
+
+
+def check_codebook_loaded(data):
+    """Raise ValueError if data references a shared codebook that has not been attached"""
+    if data['codebook'] is None:
+        raise ValueError(f"Shared codebook {data.get('codebook_id')} is not loaded")
+
+
+def raw_size(data):
+    """Size in bytes of the uncompressed RGB image"""
+    return data['original_size'][0] * data['original_size'][1] * 3
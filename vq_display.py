@@ -0,0 +1,81 @@
+import os
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+from vq_trace import span
+
+PANEL_SIZE = (500, 400)
+BACKGROUND = (255, 255, 255)
+# Shrinking by more than this factor reduces by whole factors first and finishes with a
+# bilinear pass; smaller changes in size get a single LANCZOS pass
+FAST_FILTER_FACTOR = 2
+CACHE_ENTRIES = 16
+
+
+def file_key(path):
+    """Cache key for an image file that changes whenever the file is rewritten"""
+    st = os.stat(path)
+    return ("file", os.path.abspath(path), st.st_mtime_ns, st.st_size)
+
+
+def open_image(path, size=None):
+    """Open an image as RGB; with size given, JPEGs decode at the smallest DCT scale still covering it"""
+    image = Image.open(path)
+    if size is not None and image.format == "JPEG":
+        image.draft("RGB", size)
+    return image.convert("RGB")
+
+
+def fit_panel(image, size=PANEL_SIZE):
+    """Scale an image (PIL or HxWx3 array) to fit size and centre it on a white panel of exactly that size"""
+    if isinstance(image, np.ndarray):
+        image = Image.fromarray(image)
+    with span("display", width=image.width, height=image.height):
+        scale = min(size[0] / image.width, size[1] / image.height)
+        target = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        if scale * FAST_FILTER_FACTOR < 1:
+            shown = image.resize(target, Image.Resampling.BILINEAR, reducing_gap=FAST_FILTER_FACTOR)
+        elif target != image.size:
+            shown = image.resize(target, Image.Resampling.LANCZOS)
+        else:
+            shown = image
+        panel = Image.new("RGB", size, BACKGROUND)
+        panel.paste(shown, ((size[0] - shown.width) // 2, (size[1] - shown.height) // 2))
+    return panel
+
+
+class PanelCache:
+    """Rendered panels keyed by (image key, panel size); the least recently used are dropped first
+
+    make converts each rendered PIL panel before it is cached, e.g.
+    ImageTk.PhotoImage, so a cache hit costs no resizing or conversion.
+    """
+
+    def __init__(self, make=None, max_entries=CACHE_ENTRIES):
+        self.make = make
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def render(self, key, image, size=PANEL_SIZE):
+        """Panel for image, rendered on a miss; image may be a zero-argument callable returning it
+
+        The callable only runs on a miss, so e.g. a file is not even opened
+        when its panel is cached. A key of None renders without caching.
+        """
+        full_key = (key, tuple(size))
+        if key is not None and full_key in self.entries:
+            self.entries.move_to_end(full_key)
+            return self.entries[full_key]
+        panel = fit_panel(image() if callable(image) else image, size)
+        if self.make is not None:
+            panel = self.make(panel)
+        if key is not None:
+            self.entries[full_key] = panel
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return panel
+
+    def clear(self):
+        self.entries.clear()
@@ -0,0 +1,158 @@
+import heapq
+import struct
+
+import numpy as np
+
+MAX_CODE_LEN = 16
+SEGMENT_LEN = 4096
+STREAM_HEADER = struct.Struct('<IQ')
+
+
+def huffman_lengths(freqs, max_len=MAX_CODE_LEN):
+    """Huffman code length for every symbol, limited to max_len bits (0 for unused symbols)"""
+    freqs = np.asarray(freqs, dtype=np.int64)
+    used = np.flatnonzero(freqs)
+    lengths = np.zeros(len(freqs), dtype=np.uint8)
+    if len(used) == 0:
+        return lengths
+    if len(used) == 1:
+        lengths[used] = 1
+        return lengths
+    if len(used) > 1 << max_len:
+        raise ValueError(f"Too many symbols for {max_len}-bit codes")
+
+    weights = freqs[used]
+    n = len(used)
+    while True:
+        heap = [(int(w), i) for i, w in enumerate(weights)]
+        heapq.heapify(heap)
+        parent = np.zeros(2 * n - 1, dtype=np.int64)
+        node = n
+        while len(heap) > 1:
+            w1, a = heapq.heappop(heap)
+            w2, b = heapq.heappop(heap)
+            parent[a] = parent[b] = node
+            heapq.heappush(heap, (w1 + w2, node))
+            node += 1
+        # parents are created after their children, so walk from the root down
+        depth = np.zeros(2 * n - 1, dtype=np.int64)
+        for i in range(2 * n - 3, -1, -1):
+            depth[i] = depth[parent[i]] + 1
+        if depth[:n].max() <= max_len:
+            break
+        # flatten the distribution until the longest code fits
+        weights = (weights + 1) // 2
+
+    lengths[used] = depth[:n]
+    return lengths
+
+
+def canonical_codes(lengths):
+    """Canonical Huffman codes for the given code lengths"""
+    lengths = np.asarray(lengths, dtype=np.int64)
+    codes = np.zeros(len(lengths), dtype=np.uint32)
+    order = np.lexsort((np.arange(len(lengths)), lengths))
+    code = 0
+    prev_len = 0
+    for sym in order:
+        length = lengths[sym]
+        if length == 0:
+            continue
+        code <<= length - prev_len
+        codes[sym] = code
+        code += 1
+        prev_len = length
+    return codes
+
+
+def decode_table(lengths, max_len):
+    """Lookup tables mapping every max_len-bit prefix to its symbol and code length"""
+    lengths = np.asarray(lengths, dtype=np.int64)
+    codes = canonical_codes(lengths).astype(np.int64)
+    used = np.flatnonzero(lengths)
+    spans = 1 << (max_len - lengths[used])
+    starts = codes[used] << (max_len - lengths[used])
+
+    table_sym = np.zeros(1 << max_len, dtype=np.uint32)
+    table_len = np.zeros(1 << max_len, dtype=np.uint8)
+    idx = np.repeat(starts, spans) + (np.arange(spans.sum()) - np.repeat(np.cumsum(spans) - spans, spans))
+    table_sym[idx] = np.repeat(used, spans)
+    table_len[idx] = np.repeat(lengths[used], spans)
+    return table_sym, table_len
+
+
+def write_bits(codes, lengths, n_bits):
+    """Concatenate variable-length big-endian codes into a packed byte array"""
+    starts = np.cumsum(lengths, dtype=np.int64) - lengths
+    bits = np.zeros(n_bits, dtype=np.uint8)
+    for j in range(int(lengths.max(initial=0))):
+        active = lengths > j
+        shift = (lengths[active] - 1 - j).astype(np.uint32)
+        bits[starts[active] + j] = (codes[active] >> shift) & 1
+    return np.packbits(bits)
+
+
+def huffman_encode(labels, n_symbols, max_len=MAX_CODE_LEN):
+    """Entropy-code labels, returning (code lengths, list of buffers for the label stream)
+
+    The stream is split into segments of SEGMENT_LEN labels whose starting
+    bit offsets are stored up front, so the decoder can walk every segment
+    in lockstep with vectorized table lookups.
+    """
+    labels = np.asarray(labels, dtype=np.int64)
+    lengths = huffman_lengths(np.bincount(labels, minlength=n_symbols), max_len)
+    codes = canonical_codes(lengths)
+
+    label_lengths = lengths[labels].astype(np.int64)
+    label_codes = codes[labels]
+    n_bits = int(label_lengths.sum())
+    seg_offsets = (np.cumsum(label_lengths) - label_lengths)[::SEGMENT_LEN].astype('<u8')
+    stream = write_bits(label_codes, label_lengths, n_bits)
+
+    header = STREAM_HEADER.pack(SEGMENT_LEN, n_bits)
+    return lengths, [header, memoryview(seg_offsets).cast('B'), memoryview(stream).cast('B')]
+
+
+def huffman_stream_size(n_labels, n_bits):
+    """Bytes taken by a label stream of n_labels labels coded into n_bits bits"""
+    n_segments = -(-n_labels // SEGMENT_LEN)
+    return STREAM_HEADER.size + 8 * n_segments + (n_bits + 7) // 8
+
+
+def huffman_decode(buf, offset, n_labels, lengths):
+    """Decode n_labels labels from the stream at buf[offset:], returning (labels, end offset)"""
+    if len(buf) < offset + STREAM_HEADER.size:
+        raise ValueError("Truncated .bin file: label stream header is incomplete")
+    segment_len, n_bits = STREAM_HEADER.unpack_from(buf, offset)
+    if segment_len == 0:
+        raise ValueError("Corrupt .bin file: zero label segment length")
+    n_segments = -(-n_labels // segment_len)
+    end = offset + STREAM_HEADER.size + 8 * n_segments + (n_bits + 7) // 8
+    if len(buf) < end:
+        raise ValueError("Truncated .bin file: label stream is incomplete")
+
+    pos = np.frombuffer(buf, dtype='<u8', count=n_segments, offset=offset + STREAM_HEADER.size).astype(np.int64)
+    data_start = offset + STREAM_HEADER.size + 8 * n_segments
+    stream = np.zeros((n_bits + 7) // 8 + 3, dtype=np.uint32)
+    stream[:-3] = np.frombuffer(buf, dtype=np.uint8, count=(n_bits + 7) // 8, offset=data_start)
+
+    lengths = np.asarray(lengths)
+    max_len = int(lengths.max(initial=1))
+    if max_len > MAX_CODE_LEN:
+        raise ValueError(f"Corrupt .bin file: code length {max_len} exceeds {MAX_CODE_LEN} bits")
+    table_sym, table_len = decode_table(lengths, max_len)
+    dtype = np.uint16 if len(lengths) <= 1 << 16 else np.uint32
+    labels = np.zeros(n_segments * segment_len, dtype=dtype)
+    out = labels.reshape(n_segments, segment_len)
+
+    # the last segment may be short; keep decoding it harmlessly past the end
+    mask = (1 << max_len) - 1
+    for i in range(min(segment_len, n_labels)):
+        byte = pos >> 3
+        window = (stream[byte] << 16) | (stream[byte + 1] << 8) | stream[byte + 2]
+        prefix = (window >> (24 - max_len - (pos & 7))) & mask
+        out[:, i] = table_sym[prefix]
+        pos += table_len[prefix]
+        np.minimum(pos, n_bits, out=pos)
+
+    return labels[:n_labels], end
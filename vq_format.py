@@ -0,0 +1,390 @@
+import hashlib
+import mmap
+import os
+import struct
+
+import numpy as np
+
+import vq_entropy
+from vq_assign import METRICS
+from vq_trace import traced
+
+HEADER = struct.Struct('<8I')
+HEADER_SIZE = HEADER.size
+
+# Files written with a label coding other than "raw" start with MAGIC; the
+# legacy layout starts directly with block_w, which never takes that value.
+MAGIC = b'VQBF'
+FORMAT_VERSION = 3
+# Version 1 stored bits as a uint16; its high byte, always zero, became flags.
+# Version 3 adds multi-stage codebooks; other files are still written as
+# version 2 so that older readers keep opening them.
+FORMAT_HEADER = struct.Struct('<4sBBBB8I')
+LABEL_CODINGS = ("raw", "packed", "huffman")
+DEFAULT_LABEL_CODING = "packed"
+FLAG_SHARED_CODEBOOK = 1
+LAYOUT_FLAGS = {"product": 2, "residual": 4}
+# Multi-stage files follow the header with the number of stages; the codebook
+# is then (stages, n_codewords, sub_dim) and each block has one label per stage
+STAGE_FIELD = struct.Struct('<I')
+
+# Shared codebooks live in their own file and are referenced from .bin files by ID
+CODEBOOK_MAGIC = b'VQCB'
+CODEBOOK_VERSION = 1
+CODEBOOK_HEADER = struct.Struct('<4sBB2x3I16s')
+CODEBOOK_ID_SIZE = 16
+CODEBOOK_EXTENSION = ".vqcb"
+
+
+def label_bits(n_codewords):
+    """Bits needed to store one label for a codebook of n_codewords entries"""
+    return max(1, (int(n_codewords) - 1).bit_length())
+
+
+def pack_labels(labels, bits):
+    """Pack labels into a big-endian bit stream using `bits` bits per label"""
+    labels = np.asarray(labels, dtype=np.uint32)
+    planes = np.empty((len(labels), bits), dtype=np.uint8)
+    for i in range(bits):
+        np.bitwise_and(labels >> (bits - 1 - i), 1, out=planes[:, i], casting='unsafe')
+    return np.packbits(planes.reshape(-1))
+
+
+def unpack_labels(buf, n_labels, bits):
+    """Inverse of pack_labels"""
+    planes = np.unpackbits(np.frombuffer(buf, dtype=np.uint8), count=n_labels * bits)
+    planes = planes.reshape(n_labels, bits)
+    labels = np.zeros(n_labels, dtype=np.uint16 if bits <= 16 else np.uint32)
+    for i in range(bits):
+        labels <<= 1
+        labels |= planes[:, i]
+    return labels
+
+
+def packed_size(n_labels, bits):
+    """Bytes taken by n_labels labels packed with `bits` bits each"""
+    return (n_labels * bits + 7) // 8
+
+
+def codebook_entries(data):
+    """Codewords per codebook: the whole codebook, or one stage of a multi-stage one"""
+    codebook = data['codebook']
+    return codebook.shape[1] if data.get('layout') else len(codebook)
+
+
+def encoded_size(data, label_coding=DEFAULT_LABEL_CODING):
+    """Size in bytes of the .bin file for the given compressed data"""
+    codebook = data['codebook']
+    n_codewords = codebook_entries(data)
+    n_labels = np.size(data['labels'])
+    if label_coding == "raw":
+        return HEADER_SIZE + codebook.size + n_labels * 2
+    codebook_size = CODEBOOK_ID_SIZE if data.get('codebook_id') else codebook.size
+    header_size = FORMAT_HEADER.size + (STAGE_FIELD.size if data.get('layout') else 0)
+    if label_coding == "huffman":
+        counts = np.bincount(np.asarray(data['labels'], dtype=np.int64).reshape(-1), minlength=n_codewords)
+        n_bits = int(np.dot(counts, vq_entropy.huffman_lengths(counts).astype(np.int64)))
+        return (header_size + codebook_size + n_codewords
+                + vq_entropy.huffman_stream_size(n_labels, n_bits))
+    return header_size + codebook_size + packed_size(n_labels, label_bits(n_codewords))
+
+
+def pack_header(data, n_codewords, n_labels, label_coding=DEFAULT_LABEL_CODING, bits=None, flags=0):
+    """Header bytes for the geometry in data, ahead of the codebook and labels"""
+    fields = (
+        data['block_w'], data['block_h'],
+        data['padded_size'][0], data['padded_size'][1],
+        data['original_size'][0], data['original_size'][1],
+        n_codewords, n_labels
+    )
+    if label_coding == "raw":
+        if flags:
+            raise ValueError("Raw label coding cannot reference a shared codebook or store stages")
+        if n_codewords > 65536:
+            raise ValueError("Raw label coding supports at most 65536 codewords")
+        return HEADER.pack(*fields)
+    if bits is None:
+        bits = label_bits(n_codewords)
+    version = FORMAT_VERSION if flags & sum(LAYOUT_FLAGS.values()) else 2
+    return FORMAT_HEADER.pack(MAGIC, version, LABEL_CODINGS.index(label_coding), bits, flags, *fields)
+
+
+def encode_parts(data, label_coding=DEFAULT_LABEL_CODING):
+    """Header, codebook and labels of the .bin layout as a list of contiguous buffers"""
+    if label_coding not in LABEL_CODINGS:
+        raise ValueError(f"Unknown label coding: {label_coding!r}")
+    codebook = np.ascontiguousarray(data['codebook'], dtype=np.uint8)
+    labels = np.asarray(data['labels'])
+    layout = data.get('layout')
+    n_codewords = codebook_entries(data)
+    if labels.size and (labels.min() < 0 or labels.max() >= n_codewords):
+        raise ValueError("Labels must index into the codebook")
+
+    if data.get('codebook_id'):
+        if layout:
+            raise ValueError("Multi-stage codebooks cannot be shared")
+        flags = FLAG_SHARED_CODEBOOK
+        codebook_part = bytes.fromhex(data['codebook_id'])
+    else:
+        flags = 0
+        codebook_part = memoryview(codebook).cast('B')
+    if layout:
+        if layout not in LAYOUT_FLAGS or codebook.ndim != 3 or labels.shape != (len(labels), len(codebook)):
+            raise ValueError(f"Expected a {layout!r} codebook of shape (stages, n_codewords, sub_dim) "
+                             f"with one label per stage")
+        flags |= LAYOUT_FLAGS[layout]
+        codebook_part = STAGE_FIELD.pack(len(codebook)) + bytes(codebook_part)
+        labels = labels.reshape(-1)
+
+    if label_coding == "raw":
+        header = pack_header(data, n_codewords, len(labels), label_coding, flags=flags)
+        labels = np.ascontiguousarray(labels, dtype='<u2')
+    elif label_coding == "huffman":
+        lengths, stream = vq_entropy.huffman_encode(labels, n_codewords)
+        header = pack_header(data, n_codewords, len(labels), label_coding, int(lengths.max(initial=0)), flags)
+        return [header, codebook_part, memoryview(lengths).cast('B')] + stream
+    else:
+        bits = label_bits(n_codewords)
+        header = pack_header(data, n_codewords, len(labels), label_coding, bits, flags)
+        labels = pack_labels(labels, bits)
+
+    return [header, codebook_part, memoryview(labels).cast('B')]
+
+
+def write_compressed(data, f, label_coding=DEFAULT_LABEL_CODING):
+    """Write compressed data to an open binary file-like object in the .bin layout"""
+    f.writelines(encode_parts(data, label_coding))
+
+
+def pack_into(data, buf, offset=0, label_coding=DEFAULT_LABEL_CODING):
+    """Write compressed data into a writable buffer at offset and return the bytes written"""
+    view = memoryview(buf).cast('B')
+    pos = offset
+    for part in encode_parts(data, label_coding):
+        n = len(part)
+        if pos + n > len(view):
+            raise ValueError("Buffer is too small for the compressed data")
+        view[pos:pos + n] = part
+        pos += n
+    return pos - offset
+
+
+def parse_compressed(buf, codebook=None):
+    """Parse a .bin buffer, returning the codebook (and raw labels) as zero-copy views into it
+
+    Files that reference a shared codebook carry only its ID; pass the shared
+    codebook from load_codebook as codebook, or attach it later with
+    attach_codebook. Until then the returned 'codebook' is None.
+    """
+    flags = 0
+    if len(buf) >= len(MAGIC) and bytes(buf[:len(MAGIC)]) == MAGIC:
+        if len(buf) < FORMAT_HEADER.size:
+            raise ValueError("Truncated .bin file: header is incomplete")
+        magic, version, coding, bits, flags, *fields = FORMAT_HEADER.unpack_from(buf, 0)
+        if version not in (1, 2, FORMAT_VERSION):
+            raise ValueError(f"Unsupported .bin format version {version}")
+        if coding >= len(LABEL_CODINGS):
+            raise ValueError(f"Unknown label coding {coding} in .bin file")
+        label_coding = LABEL_CODINGS[coding]
+        offset = FORMAT_HEADER.size
+    else:
+        if len(buf) < HEADER_SIZE:
+            raise ValueError("Truncated .bin file: header is incomplete")
+        fields = HEADER.unpack_from(buf, 0)
+        label_coding = "raw"
+        offset = HEADER_SIZE
+
+    block_w, block_h, padded_w, padded_h, orig_w, orig_h, n_codewords, n_labels = fields
+    shared = bool(flags & FLAG_SHARED_CODEBOOK)
+    layout = next((name for name, flag in LAYOUT_FLAGS.items() if flags & flag), None)
+    stages = 1
+    if layout:
+        if len(buf) < offset + STAGE_FIELD.size:
+            raise ValueError("Truncated .bin file: header is incomplete")
+        stages, = STAGE_FIELD.unpack_from(buf, offset)
+        offset += STAGE_FIELD.size
+        if stages == 0 or n_labels % stages:
+            raise ValueError("Corrupt .bin file: label count does not match the number of stages")
+    n_blocks = n_labels // stages
+    dim = block_h * block_w * 3
+    if layout == "product":
+        if dim % stages:
+            raise ValueError("Corrupt .bin file: block size does not split into the stored stages")
+        codeword_shape = (stages, n_codewords, dim // stages)
+    elif layout == "residual":
+        codeword_shape = (stages, n_codewords, dim)
+    else:
+        codeword_shape = (n_codewords, block_h, block_w, 3)
+    codebook_size = CODEBOOK_ID_SIZE if shared else int(np.prod(codeword_shape))
+    if label_coding == "raw":
+        labels_size = n_labels * 2
+    elif label_coding == "huffman":
+        labels_size = n_codewords
+    else:
+        labels_size = packed_size(n_labels, bits)
+    if len(buf) < offset + codebook_size + labels_size:
+        raise ValueError("Truncated .bin file: codebook or labels are incomplete")
+
+    stored = None
+    if shared:
+        codebook_id = bytes(buf[offset:offset + CODEBOOK_ID_SIZE]).hex()
+    else:
+        codebook_id = None
+        stored = np.frombuffer(buf, dtype=np.uint8, count=codebook_size, offset=offset)
+        stored = stored.reshape(codeword_shape)
+    offset += codebook_size
+    if label_coding == "raw":
+        labels = np.frombuffer(buf, dtype='<u2', count=n_labels, offset=offset)
+    elif label_coding == "huffman":
+        lengths = np.frombuffer(buf, dtype=np.uint8, count=n_codewords, offset=offset)
+        labels, _ = vq_entropy.huffman_decode(buf, offset + n_codewords, n_labels, lengths)
+    else:
+        labels = unpack_labels(memoryview(buf)[offset:offset + labels_size], n_labels, bits)
+    if layout:
+        labels = labels.reshape(n_blocks, stages)
+
+    data = {
+        'codebook': stored,
+        'labels': labels,
+        'block_w': block_w,
+        'block_h': block_h,
+        'padded_size': (padded_w, padded_h),
+        'original_size': (orig_w, orig_h),
+        'label_coding': label_coding,
+        'codebook_id': codebook_id,
+        'n_codewords': n_codewords,
+        'layout': layout
+    }
+    if shared and codebook is not None:
+        attach_codebook(data, codebook)
+    return data
+
+
+def read_compressed(f):
+    """Read compressed data from an open binary file in the .bin layout"""
+    return parse_compressed(f.read())
+
+
+@traced("save")
+def save_compressed(data, filepath, label_coding=DEFAULT_LABEL_CODING):
+    """Save compressed data to .bin file"""
+    with open(filepath, 'wb') as f:
+        write_compressed(data, f, label_coding)
+
+
+@traced("load")
+def load_compressed(filepath, use_mmap=True, codebook=None):
+    """Load compressed data from .bin file, memory-mapped unless use_mmap is False
+
+    The returned arrays are read-only views into the mapping, which stays
+    open for as long as any of them is referenced. A referenced shared
+    codebook is taken from codebook or, failing that, looked up as
+    <id>.vqcb next to the file.
+    """
+    with open(filepath, 'rb') as f:
+        if not use_mmap or os.fstat(f.fileno()).st_size == 0:
+            data = parse_compressed(f.read(), codebook)
+        else:
+            data = parse_compressed(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), codebook)
+
+    if data['codebook'] is None:
+        path = find_codebook(data['codebook_id'], [os.path.dirname(os.path.abspath(filepath))])
+        if path is not None:
+            attach_codebook(data, load_codebook(path))
+    return data
+
+
+@traced("serialize")
+def to_bytes(data, label_coding=DEFAULT_LABEL_CODING):
+    """Serialize compressed data to bytes"""
+    return b"".join(encode_parts(data, label_coding))
+
+
+@traced("parse")
+def from_bytes(buf, codebook=None):
+    """Deserialize compressed data from bytes without copying the arrays"""
+    return parse_compressed(buf, codebook)
+
+
+def codebook_id(codebook):
+    """Hex ID of a uint8 codebook, derived from its shape and contents"""
+    codebook = np.ascontiguousarray(codebook, dtype=np.uint8)
+    h = hashlib.blake2b(digest_size=CODEBOOK_ID_SIZE)
+    h.update(struct.pack('<4I', *codebook.shape))
+    h.update(memoryview(codebook).cast('B'))
+    return h.hexdigest()
+
+
+def make_shared_codebook(codebook, metric="l1"):
+    """Wrap a (K, block_h, block_w, 3) uint8 codebook for storing in its own file"""
+    codebook = np.ascontiguousarray(codebook, dtype=np.uint8)
+    if codebook.ndim != 4 or codebook.shape[3] != 3:
+        raise ValueError(f"Expected a (K, block_h, block_w, 3) codebook, got shape {codebook.shape}")
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric: {metric!r}")
+    return {
+        'codebook': codebook,
+        'codebook_id': codebook_id(codebook),
+        'block_w': codebook.shape[2],
+        'block_h': codebook.shape[1],
+        'metric': metric
+    }
+
+
+def save_codebook(shared, filepath):
+    """Save a shared codebook to a .vqcb file"""
+    codebook = shared['codebook']
+    header = CODEBOOK_HEADER.pack(
+        CODEBOOK_MAGIC, CODEBOOK_VERSION, METRICS.index(shared['metric']),
+        shared['block_w'], shared['block_h'], len(codebook), bytes.fromhex(shared['codebook_id'])
+    )
+    with open(filepath, 'wb') as f:
+        f.writelines([header, memoryview(codebook).cast('B')])
+
+
+def load_codebook(filepath):
+    """Load a shared codebook from a .vqcb file"""
+    with open(filepath, 'rb') as f:
+        buf = f.read()
+    if len(buf) < CODEBOOK_HEADER.size or buf[:len(CODEBOOK_MAGIC)] != CODEBOOK_MAGIC:
+        raise ValueError("Not a codebook file")
+    magic, version, metric, block_w, block_h, n_codewords, cid = CODEBOOK_HEADER.unpack_from(buf, 0)
+    if version != CODEBOOK_VERSION:
+        raise ValueError(f"Unsupported codebook file version {version}")
+    size = n_codewords * block_h * block_w * 3
+    if len(buf) < CODEBOOK_HEADER.size + size:
+        raise ValueError("Truncated codebook file")
+    codebook = np.frombuffer(buf, dtype=np.uint8, count=size, offset=CODEBOOK_HEADER.size)
+    codebook = codebook.reshape(n_codewords, block_h, block_w, 3)
+    if codebook_id(codebook) != cid.hex():
+        raise ValueError("Codebook file is corrupt: contents do not match its ID")
+    return {
+        'codebook': codebook,
+        'codebook_id': cid.hex(),
+        'block_w': block_w,
+        'block_h': block_h,
+        'metric': METRICS[metric]
+    }
+
+
+def codebook_filename(codebook_id):
+    return codebook_id + CODEBOOK_EXTENSION
+
+
+def find_codebook(codebook_id, search_dirs):
+    """Path of the .vqcb file for codebook_id in the first directory that has it, or None"""
+    for directory in search_dirs:
+        path = os.path.join(directory, codebook_filename(codebook_id))
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def attach_codebook(data, shared):
+    """Fill in the shared codebook a parsed .bin refers to, checking that it is the right one"""
+    if shared['codebook_id'] != data['codebook_id']:
+        raise ValueError(f"Codebook {shared['codebook_id']} does not match the file's {data['codebook_id']}")
+    if (shared['block_w'], shared['block_h']) != (data['block_w'], data['block_h']):
+        raise ValueError("Codebook block size does not match the file")
+    data['codebook'] = shared['codebook']
+    return data
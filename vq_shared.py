@@ -0,0 +1,60 @@
+import numpy as np
+
+import vq_codec
+import vq_format
+import vq_stream
+from vq_assign import nearest_codeword
+
+DEFAULT_SAMPLES_PER_IMAGE = 4096
+
+
+def train_shared_codebook(sources, block_w=vq_codec.DEFAULT_BLOCK_W, block_h=vq_codec.DEFAULT_BLOCK_H,
+                          n_clusters=vq_codec.DEFAULT_CLUSTERS, mode=vq_codec.DEFAULT_MODE,
+                          samples_per_image=DEFAULT_SAMPLES_PER_IMAGE, seed=0):
+    """Train one codebook on blocks sampled from every image in sources
+
+    Each source is anything vq_stream.open_source accepts; images are read
+    strip by strip, so only the sampled blocks are kept in memory.
+    """
+    vq_codec.check_block_size(block_w, block_h)
+    vq_codec.check_mode(mode)
+    if mode in vq_codec.STAGE_MODES:
+        raise ValueError(f"The {mode!r} quantizer has one codebook per stage and cannot be shared")
+    if n_clusters <= 0:
+        raise ValueError("Number of codewords must be positive!")
+
+    samples = []
+    for i, source in enumerate(sources):
+        width, height, read_rows = vq_stream.open_source(source)
+        rows = vq_stream.strip_rows(width, block_h)
+        samples.append(vq_stream.sample_blocks(read_rows, width, height, block_w, block_h, rows,
+                                               samples_per_image, seed + i))
+    if not samples:
+        raise ValueError("No images to train on")
+    flat = np.concatenate(samples)
+
+    trained = vq_codec.train_codebook(flat, min(n_clusters, len(flat)), mode)
+    codebook = vq_codec.codebook_to_uint8(trained, mode).reshape(-1, block_h, block_w, 3)
+    return vq_format.make_shared_codebook(codebook, vq_codec.default_metric(mode))
+
+
+def encode_shared(image, shared):
+    """Compress an image against a shared codebook; only assignment runs per image"""
+    image = vq_codec.as_rgb_array(image)
+    h, w = image.shape[:2]
+    block_w, block_h = shared['block_w'], shared['block_h']
+    codebook = shared['codebook']
+
+    blocks, padded_size = vq_codec.image_blocks(image, block_w, block_h)
+    labels = nearest_codeword(blocks.reshape(len(blocks), -1), codebook.reshape(len(codebook), -1),
+                              metric=shared['metric'])
+
+    return {
+        'codebook': codebook,
+        'codebook_id': shared['codebook_id'],
+        'labels': labels,
+        'block_w': block_w,
+        'block_h': block_h,
+        'padded_size': padded_size,
+        'original_size': (w, h)
+    }
@@ -0,0 +1,214 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+import vq_codec
+import vq_format
+from vq_assign import nearest_codeword
+from vq_trace import traced
+
+DEFAULT_STRIP_BYTES = 32 * 1024 * 1024
+DEFAULT_SAMPLE_BLOCKS = 65536
+STREAM_LABEL_CODINGS = ("raw", "packed")
+
+
+def open_source(source):
+    """Return (width, height, read_rows) for an HxWx3 array, a .npy file or an image path
+
+    read_rows(y0, y1) returns image rows y0..y1 as an RGB uint8 array. Arrays
+    (including np.memmap) and .npy files, which are opened memory-mapped, are
+    sliced without touching the rest of the image; other files are decoded
+    by PIL, which holds the decoded image but no extra NumPy copies of it.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        if not os.fspath(source).lower().endswith(".npy"):
+            image = Image.open(source)
+            width, height = image.size
+
+            def read_rows(y0, y1):
+                return np.asarray(image.crop((0, y0, width, y1)).convert("RGB"))
+
+            return width, height, read_rows
+        source = np.load(source, mmap_mode='r')
+
+    if source.ndim != 3 or source.shape[2] != 3:
+        raise ValueError(f"Expected an HxWx3 RGB image, got shape {source.shape}")
+    height, width = source.shape[:2]
+
+    def read_rows(y0, y1):
+        return vq_codec.as_rgb_array(source[y0:y1])
+
+    return width, height, read_rows
+
+
+def strip_rows(width, block_h, max_bytes=DEFAULT_STRIP_BYTES):
+    """Rows per strip, a multiple of block_h, keeping a strip and its block copy under max_bytes"""
+    rows = max_bytes // max(3 * width * 3, 1)
+    return max(block_h, rows // block_h * block_h)
+
+
+def iter_strips(read_rows, width, height, block_w, block_h, rows):
+    """Yield (y0, strip) for strips of `rows` image rows; only the last strip may be shorter"""
+    for y0 in range(0, height, rows):
+        yield y0, read_rows(y0, min(y0 + rows, height))
+
+
+def strip_blocks(strip, block_w, block_h):
+    """Flattened blocks of one strip, edge-padded to whole blocks"""
+    blocks, _ = vq_codec.image_blocks(strip, block_w, block_h)
+    return blocks.reshape(len(blocks), -1)
+
+
+def sample_blocks(read_rows, width, height, block_w, block_h, rows, n_samples=DEFAULT_SAMPLE_BLOCKS, seed=0):
+    """Uniform random sample of about n_samples flattened blocks, gathered strip by strip"""
+    total = -(-width // block_w) * -(-height // block_h)
+    keep = min(1.0, n_samples / max(total, 1))
+    rng = np.random.default_rng(seed)
+    picked = []
+    for _, strip in iter_strips(read_rows, width, height, block_w, block_h, rows):
+        flat = strip_blocks(strip, block_w, block_h)
+        picked.append(flat[rng.random(len(flat)) < keep])
+    sample = np.concatenate(picked)
+    if len(sample) == 0:
+        raise ValueError("Image is empty")
+    return sample
+
+
+@traced("encode_stream")
+def encode_stream(source, out, block_w=vq_codec.DEFAULT_BLOCK_W, block_h=vq_codec.DEFAULT_BLOCK_H,
+                  n_clusters=vq_codec.DEFAULT_CLUSTERS, mode=vq_codec.DEFAULT_MODE, codebook=None,
+                  label_coding=vq_format.DEFAULT_LABEL_CODING, max_bytes=DEFAULT_STRIP_BYTES,
+                  sample_blocks_n=DEFAULT_SAMPLE_BLOCKS):
+    """Compress an image strip by strip into a .bin file without holding it in memory
+
+    source is anything open_source accepts and out a path or writable binary
+    file. Unless a uint8 codebook is given, one is trained on blocks sampled
+    across all strips in a first pass; the second pass assigns each strip and
+    appends its labels to the output. Returns the geometry written to the header.
+    """
+    vq_codec.check_block_size(block_w, block_h)
+    vq_codec.check_mode(mode)
+    if mode in vq_codec.STAGE_MODES:
+        raise ValueError(f"The {mode!r} quantizer cannot be streamed; use vq_codec.encode")
+    if label_coding not in STREAM_LABEL_CODINGS:
+        raise ValueError(f"Label coding {label_coding!r} needs all labels up front; "
+                         f"stream with one of {STREAM_LABEL_CODINGS}")
+    width, height, read_rows = open_source(source)
+    rows = strip_rows(width, block_h, max_bytes)
+
+    if codebook is None:
+        if n_clusters <= 0:
+            raise ValueError("Number of codewords must be positive!")
+        sample = sample_blocks(read_rows, width, height, block_w, block_h, rows, sample_blocks_n)
+        trained = vq_codec.train_codebook(sample, min(n_clusters, len(sample)), mode)
+        codebook = vq_codec.codebook_to_uint8(trained, mode).reshape(-1, block_h, block_w, 3)
+    else:
+        codebook = np.ascontiguousarray(codebook, dtype=np.uint8)
+        if codebook.shape[1:] not in ((block_h, block_w, 3), (block_h * block_w * 3,)):
+            raise ValueError(f"Codebook of shape {codebook.shape} does not match {block_w}x{block_h} blocks")
+        codebook = codebook.reshape(-1, block_h, block_w, 3)
+        # kept as uint8 so l1 assignment runs on the exact int16 path
+        trained = codebook.reshape(len(codebook), -1)
+
+    padded_size = (-(-width // block_w) * block_w, -(-height // block_h) * block_h)
+    info = {
+        'block_w': block_w,
+        'block_h': block_h,
+        'padded_size': padded_size,
+        'original_size': (width, height),
+        'n_codewords': len(codebook),
+        'n_blocks': (padded_size[0] // block_w) * (padded_size[1] // block_h)
+    }
+    bits = vq_format.label_bits(len(codebook))
+    metric = vq_codec.default_metric(mode)
+
+    f = open(out, 'wb') if isinstance(out, (str, os.PathLike)) else out
+    try:
+        f.write(vq_format.pack_header(info, len(codebook), info['n_blocks'], label_coding, bits))
+        f.write(memoryview(codebook).cast('B'))
+        pending = np.empty(0, dtype=np.intp)
+        for _, strip in iter_strips(read_rows, width, height, block_w, block_h, rows):
+            labels = nearest_codeword(strip_blocks(strip, block_w, block_h), trained, metric=metric)
+            if label_coding == "raw":
+                f.write(labels.astype('<u2').tobytes())
+                continue
+            # 8 labels always fill whole bytes, so pack in multiples of 8 and carry the rest
+            labels = np.concatenate((pending, labels))
+            cut = len(labels) - len(labels) % 8
+            f.write(vq_format.pack_labels(labels[:cut], bits).tobytes())
+            pending = labels[cut:]
+        if len(pending):
+            f.write(vq_format.pack_labels(pending, bits).tobytes())
+    finally:
+        if f is not out:
+            f.close()
+
+    return info
+
+
+def open_output(out, width, height):
+    """Return (write_rows, close, result) for an array, a .npy path or a PPM path / binary file"""
+    if isinstance(out, np.ndarray):
+        if out.shape != (height, width, 3):
+            raise ValueError(f"Output array must have shape {(height, width, 3)}, got {out.shape}")
+
+        def write_rows(y0, rows):
+            out[y0:y0 + len(rows)] = rows
+
+        return write_rows, lambda: None, out
+
+    if isinstance(out, (str, os.PathLike)) and os.fspath(out).lower().endswith(".npy"):
+        arr = np.lib.format.open_memmap(out, mode='w+', dtype=np.uint8, shape=(height, width, 3))
+
+        def write_rows(y0, rows):
+            arr[y0:y0 + len(rows)] = rows
+
+        return write_rows, arr.flush, arr
+
+    if isinstance(out, (str, os.PathLike)):
+        if not os.fspath(out).lower().endswith((".ppm", ".pnm")):
+            raise ValueError("Streaming output must be an array, a .npy file or a .ppm/.pnm file")
+        f = open(out, 'wb')
+        close = f.close
+    else:
+        f = out
+        close = f.flush
+    f.write(b"P6\n%d %d\n255\n" % (width, height))
+
+    def write_rows(y0, rows):
+        f.write(np.ascontiguousarray(rows).tobytes())
+
+    return write_rows, close, None
+
+
+@traced("decode_stream")
+def decode_stream(source, out, max_bytes=vq_codec.DECODE_STRIP_BYTES, codebook=None):
+    """Reconstruct a .bin strip by strip straight into out without building the full image
+
+    source is a .bin path, bytes, or a dict from vq_format; out is an HxWx3
+    array, a .npy path (written as a memory-mapped array), or a .ppm/.pnm
+    path or binary file (written row by row). Returns the array written to,
+    or None for PPM output. codebook is the shared codebook for files that
+    reference one.
+    """
+    if isinstance(source, dict):
+        data = source
+    elif isinstance(source, (str, os.PathLike)):
+        data = vq_format.load_compressed(source, codebook=codebook)
+    else:
+        data = vq_format.from_bytes(source, codebook)
+    vq_codec.check_codebook_loaded(data)
+
+    width, height = data['original_size']
+    write_rows, close, result = open_output(out, width, height)
+    block_rows = vq_codec.strip_block_rows(data['padded_size'][0], data['block_h'], max_bytes)
+    try:
+        for y0, rows in vq_codec.reconstruct_strips(data['codebook'], data['labels'], data['block_w'],
+                                                    data['block_h'], data['padded_size'],
+                                                    data['original_size'], block_rows, data.get('layout')):
+            write_rows(y0, rows)
+    finally:
+        close()
+
+    return result
@@ -0,0 +1,218 @@
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+# VQ_TRACE is a comma-separated list of sinks: "log", "memory" or "json:<path>".
+# VQ_TRACE_MEMORY=1 also starts tracemalloc so spans record allocated bytes.
+ENV_VAR = "VQ_TRACE"
+MEMORY_ENV_VAR = "VQ_TRACE_MEMORY"
+
+logger = logging.getLogger("vq.trace")
+sinks = []
+local = threading.local()
+
+
+class LogSink:
+    """Writes one log line per finished span through the "vq.trace" logger"""
+
+    def __init__(self, level=logging.INFO):
+        self.level = level
+
+    def emit(self, record):
+        extra = " ".join(f"{k}={v}" for k, v in record.items()
+                         if k not in ("name", "parent", "depth", "start", "wall_s", "cpu_s", "thread"))
+        logger.log(self.level, "%s%s wall=%.2fms cpu=%.2fms %s", "  " * record['depth'], record['name'],
+                   record['wall_s'] * 1000, record['cpu_s'] * 1000, extra)
+
+
+class JsonSink:
+    """Appends finished spans to a file as JSON lines"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def emit(self, record):
+        line = json.dumps(record) + "\n"
+        with self.lock:
+            with open(self.path, 'a') as f:
+                f.write(line)
+
+
+class MemorySink:
+    """Keeps finished spans in a list, e.g. for tests or the benchmark harness"""
+
+    def __init__(self):
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+    def clear(self):
+        self.records.clear()
+
+
+def add_sink(sink):
+    sinks.append(sink)
+    return sink
+
+
+def remove_sink(sink):
+    if sink in sinks:
+        sinks.remove(sink)
+
+
+def enabled():
+    return bool(sinks)
+
+
+def describe(fields):
+    """Flatten span fields, replacing arrays by their shape and size in bytes"""
+    out = {}
+    for key, value in fields.items():
+        if isinstance(value, np.ndarray):
+            out[f"{key}_shape"] = list(value.shape)
+            out[f"{key}_bytes"] = int(value.nbytes)
+        elif isinstance(value, (int, float, str, bool)) or value is None:
+            out[key] = value
+        else:
+            out[key] = str(value)
+    return out
+
+
+class Span:
+    """Times a stage (wall and the calling thread's CPU) and, while tracemalloc runs, the bytes it allocated
+
+    tracemalloc has one process-wide peak, which every span resets on entry.
+    Spans opened by another thread at the same time (e.g. the GUI's display
+    spans during an encode) therefore reset it too, making peak_bytes too
+    low, and alloc_bytes includes the other thread's allocations. Trust the
+    byte counts only when a single thread is traced.
+    """
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.child_peak = 0
+
+    def set(self, **fields):
+        """Attach more fields, e.g. sizes of the arrays a stage produced"""
+        self.fields.update(fields)
+
+    def __enter__(self):
+        stack = getattr(local, 'stack', None)
+        if stack is None:
+            stack = local.stack = []
+        self.parent = stack[-1] if stack else None
+        stack.append(self)
+        self.tracing = tracemalloc.is_tracing()
+        if self.tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            if self.parent is not None:
+                # resetting the peak below would hide the parent's peak so far
+                self.parent.child_peak = max(self.parent.child_peak, peak)
+            tracemalloc.reset_peak()
+            self.start_bytes = current
+        self.start = time.time()
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self.start_wall
+        cpu = time.thread_time() - self.start_cpu
+        local.stack.pop()
+        record = {
+            'name': self.name,
+            'parent': self.parent.name if self.parent else None,
+            'depth': len(local.stack),
+            'start': self.start,
+            'wall_s': wall,
+            'cpu_s': cpu,
+            'thread': threading.current_thread().name
+        }
+        if self.tracing and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, self.child_peak)
+            if self.parent is not None:
+                self.parent.child_peak = max(self.parent.child_peak, peak)
+            record['alloc_bytes'] = current - self.start_bytes
+            record['peak_bytes'] = peak - self.start_bytes
+        if exc_type is not None:
+            record['error'] = exc_type.__name__
+        record.update(describe(self.fields))
+        for sink in list(sinks):
+            sink.emit(record)
+        return False
+
+
+class NullSpan:
+    """Stand-in returned while no sink is installed"""
+
+    def set(self, **fields):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+def span(name, **fields):
+    """Context manager recording one pipeline stage; arrays in fields are recorded by size
+
+    Costs one list check when tracing is off.
+    """
+    if not sinks:
+        return NULL_SPAN
+    return Span(name, fields)
+
+
+def traced(name):
+    """Decorator wrapping every call in span(name), recording the sizes of array arguments and results"""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not sinks:
+                return fn(*args, **kwargs)
+            fields = {f"arg{i}": a for i, a in enumerate(args) if isinstance(a, np.ndarray)}
+            fields.update((k, v) for k, v in kwargs.items() if isinstance(v, np.ndarray))
+            with Span(name, fields) as s:
+                result = fn(*args, **kwargs)
+                if isinstance(result, np.ndarray):
+                    s.set(result=result)
+                return result
+        return wrapper
+    return decorate
+
+
+def configure_from_env(environ=None):
+    """Install the sinks named in VQ_TRACE and start tracemalloc if VQ_TRACE_MEMORY is set"""
+    environ = os.environ if environ is None else environ
+    for item in filter(None, (s.strip() for s in environ.get(ENV_VAR, "").split(","))):
+        if item == "log":
+            if not logger.handlers:
+                logger.addHandler(logging.StreamHandler())
+                logger.setLevel(logging.INFO)
+            add_sink(LogSink())
+        elif item == "memory":
+            add_sink(MemorySink())
+        elif item.startswith("json:"):
+            add_sink(JsonSink(item[len("json:"):]))
+        else:
+            logger.warning("Unknown %s sink %r", ENV_VAR, item)
+    if environ.get(MEMORY_ENV_VAR, "") not in ("", "0") and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+configure_from_env()
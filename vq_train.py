@@ -0,0 +1,255 @@
+import heapq
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from vq_assign import nearest_codeword
+
+DEFAULT_KMEANS_ITER = 20
+# Below this many blocks k-means runs in-process; the pool costs more than it saves
+PARALLEL_MIN_BLOCKS = 100000
+# Worker processes for k-means; None uses every core
+TRAIN_WORKERS = None
+
+# Set in k-means worker processes by attach_blocks
+worker_shm = None
+worker_blocks = None
+
+
+def mean_split_codebook(flat, n_clusters):
+    """Codebook from equal-size groups of blocks sorted by their mean intensity"""
+    means = flat.mean(axis=1)
+    sorted_blocks = flat[np.argsort(means)]
+    groups = np.array_split(sorted_blocks, n_clusters)
+    return np.array([g.mean(axis=0) for g in groups], dtype=np.float32)
+
+
+def minibatch_kmeans(flat, n_clusters, batch_size=2048, max_iter=200, tol=1e-3, patience=5, seed=0,
+                     progress=None):
+    """Train a codebook with mini-batch k-means on randomly sampled batches of blocks
+
+    Centroids start from the mean-split codebook and move towards each batch
+    with a per-centroid learning rate of 1 / (blocks seen so far). Training
+    stops once the mean centroid movement stays below tol (in pixel units)
+    for `patience` consecutive batches. progress, if given, is called as
+    progress(batch, max_iter) after every batch.
+    """
+    n_blocks = len(flat)
+    n_clusters = min(n_clusters, n_blocks)
+    rng = np.random.default_rng(seed)
+
+    codebook = mean_split_codebook(flat, n_clusters)
+    counts = np.zeros(n_clusters, dtype=np.float64)
+    batch_size = min(batch_size, n_blocks)
+    calm = 0
+
+    for it in range(max_iter):
+        idx = rng.choice(n_blocks, size=batch_size, replace=False) if batch_size < n_blocks else np.arange(n_blocks)
+        batch = flat[idx].astype(np.float32)
+        labels = nearest_codeword(batch, codebook, metric="l2")
+
+        batch_counts = np.bincount(labels, minlength=n_clusters)
+        sums = np.zeros_like(codebook)
+        np.add.at(sums, labels, batch)
+
+        hit = batch_counts > 0
+        counts[hit] += batch_counts[hit]
+        rate = (batch_counts[hit] / counts[hit]).astype(np.float32)[:, None]
+        target = sums[hit] / batch_counts[hit, None]
+        old = codebook[hit].copy()
+        codebook[hit] += rate * (target - old)
+
+        shift = np.abs(codebook[hit] - old).mean() if hit.any() else 0.0
+        calm = calm + 1 if shift < tol else 0
+        if progress is not None:
+            progress(it + 1, max_iter)
+        if calm >= patience:
+            break
+
+    return codebook
+
+
+def two_means(x, iters=6):
+    """Split x into two clusters, returning (hyperplane w, t, mask) or None if it cannot be split
+
+    The mask selects the rows with x . w > t, i.e. those closer to the
+    first centroid. Centroids start from two far-apart rows.
+    """
+    center = x.mean(axis=0)
+    a = x[np.argmax(((x - center) ** 2).sum(axis=1))]
+    b = x[np.argmax(((x - a) ** 2).sum(axis=1))]
+    if np.array_equal(a, b):
+        return None
+
+    for _ in range(iters):
+        w = a - b
+        t = (a @ a - b @ b) / 2
+        mask = x @ w > t
+        if mask.all() or not mask.any():
+            return None
+        new_a = x[mask].mean(axis=0)
+        new_b = x[~mask].mean(axis=0)
+        if np.allclose(new_a, a) and np.allclose(new_b, b):
+            break
+        a, b = new_a, new_b
+
+    w = a - b
+    t = (a @ a - b @ b) / 2
+    mask = x @ w > t
+    if mask.all() or not mask.any():
+        return None
+    return w, t, mask
+
+
+def build_tree(flat, n_leaves, iters=6, progress=None):
+    """Tree-structured codebook grown by repeatedly splitting the leaf with the largest distortion
+
+    Returns a dict with a hyperplane per internal node ('w', 't'; a block
+    goes left when block . w > t), child indices 'left'/'right' (-1 at
+    leaves), 'leaf' mapping nodes to codeword indices (-1 for internal
+    nodes) and the leaf centroids as 'codebook'. Leaves whose blocks are
+    all identical are never split, so the tree may end up with fewer
+    than n_leaves leaves. progress, if given, is called as
+    progress(leaves, n_leaves) after every split.
+    """
+    dim = flat.shape[1]
+    planes_w = [np.zeros(dim, dtype=np.float32)]
+    planes_t = [0.0]
+    left = [-1]
+    right = [-1]
+    centroids = [flat.mean(axis=0, dtype=np.float64).astype(np.float32)]
+    members = {0: np.arange(len(flat))}
+
+    def sse(node):
+        x = flat[members[node]].astype(np.float32)
+        return float(((x - centroids[node]) ** 2).sum())
+
+    heap = [(-sse(0), 0)]
+    n_leaf = 1
+    while n_leaf < n_leaves and heap:
+        neg_sse, node = heapq.heappop(heap)
+        if neg_sse >= 0:
+            break
+        idx = members[node]
+        split = two_means(flat[idx].astype(np.float32), iters)
+        if split is None:
+            continue
+        w, t, mask = split
+        del members[node]
+        planes_w[node] = w.astype(np.float32)
+        planes_t[node] = float(t)
+
+        children = []
+        for part in (idx[mask], idx[~mask]):
+            child = len(centroids)
+            children.append(child)
+            planes_w.append(np.zeros(dim, dtype=np.float32))
+            planes_t.append(0.0)
+            left.append(-1)
+            right.append(-1)
+            centroids.append(flat[part].mean(axis=0, dtype=np.float64).astype(np.float32))
+            members[child] = part
+            heapq.heappush(heap, (-sse(child), child))
+        left[node], right[node] = children
+        n_leaf += 1
+        if progress is not None:
+            progress(n_leaf, n_leaves)
+
+    left = np.array(left, dtype=np.intp)
+    is_leaf = left < 0
+    leaf = np.full(len(left), -1, dtype=np.intp)
+    leaf[is_leaf] = np.arange(is_leaf.sum())
+    return {
+        'w': np.array(planes_w, dtype=np.float32),
+        't': np.array(planes_t, dtype=np.float32),
+        'left': left,
+        'right': np.array(right, dtype=np.intp),
+        'leaf': leaf,
+        'codebook': np.array(centroids, dtype=np.float32)[is_leaf]
+    }
+
+
+def centroid_sums(x, labels, n_clusters):
+    """Per-cluster float64 sums of the rows of x and the number of rows in each cluster"""
+    counts = np.bincount(labels, minlength=n_clusters)
+    sums = np.zeros((n_clusters, x.shape[1]), dtype=np.float64)
+    filled = np.flatnonzero(counts)
+    if len(filled):
+        order = np.argsort(labels, kind="stable")
+        starts = (np.cumsum(counts) - counts)[filled]
+        sums[filled] = np.add.reduceat(x[order], starts, axis=0, dtype=np.float64)
+    return sums, counts
+
+
+def attach_blocks(name, shape, dtype):
+    """Pool initializer mapping the shared block array into a worker process"""
+    global worker_shm, worker_blocks
+    worker_shm = shared_memory.SharedMemory(name=name)
+    worker_blocks = np.ndarray(shape, dtype=dtype, buffer=worker_shm.buf)
+
+
+def kmeans_shard(start, end, codebook):
+    """Assign blocks start..end of the shared array and return their centroid sums and counts"""
+    x = worker_blocks[start:end]
+    return centroid_sums(x, nearest_codeword(x, codebook, metric="l2"), len(codebook))
+
+
+def lloyd_iterations(codebook, partials, max_iter, tol, progress=None):
+    """Lloyd updates where partials(codebook) returns (sums, counts) per shard of the blocks"""
+    for it in range(max_iter):
+        parts = partials(codebook)
+        sums = sum(p[0] for p in parts)
+        counts = sum(p[1] for p in parts)
+        filled = counts > 0
+        updated = codebook.copy()
+        updated[filled] = sums[filled] / counts[filled, None]
+        shift = np.abs(updated - codebook).max(initial=0.0)
+        codebook = updated
+        if progress is not None:
+            progress(it + 1, max_iter)
+        if shift < tol:
+            break
+    return codebook
+
+
+def kmeans(flat, n_clusters, max_iter=DEFAULT_KMEANS_ITER, tol=0.5, workers=None, progress=None):
+    """Full-batch Lloyd k-means with the assignment step sharded across worker processes
+
+    Centroids start from the mean-split codebook. The flattened blocks are
+    copied once into shared memory; every iteration sends only the codebook
+    to the workers, which return per-shard centroid sums and counts to be
+    reduced here. Stops when no centroid moves by tol or more (pixel units).
+    progress, if given, is called as progress(iteration, max_iter).
+    """
+    flat = np.ascontiguousarray(flat)
+    n_blocks = len(flat)
+    n_clusters = min(n_clusters, n_blocks)
+    codebook = mean_split_codebook(flat, n_clusters)
+
+    workers = workers or TRAIN_WORKERS or os.cpu_count() or 1
+    if workers == 1 or n_blocks < PARALLEL_MIN_BLOCKS:
+        def partials(cb):
+            return [centroid_sums(flat, nearest_codeword(flat, cb, metric="l2"), n_clusters)]
+        return lloyd_iterations(codebook, partials, max_iter, tol, progress)
+
+    bounds = np.linspace(0, n_blocks, workers + 1).astype(int)
+    # never fork: the caller may be a threaded process such as the GUI
+    start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    shm = shared_memory.SharedMemory(create=True, size=flat.nbytes)
+    try:
+        blocks = np.ndarray(flat.shape, dtype=flat.dtype, buffer=shm.buf)
+        blocks[:] = flat
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context(start_method),
+                                 initializer=attach_blocks,
+                                 initargs=(shm.name, flat.shape, flat.dtype.str)) as pool:
+            def partials(cb):
+                return list(pool.map(kmeans_shard, bounds[:-1], bounds[1:], [cb] * workers))
+            codebook = lloyd_iterations(codebook, partials, max_iter, tol, progress)
+        del blocks
+    finally:
+        shm.close()
+        shm.unlink()
+    return codebook